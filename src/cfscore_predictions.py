@@ -11,7 +11,7 @@ from sklearn import linear_model
 from sklearn.cross_validation import KFold
 from sklearn.decomposition import PCA, FastICA, FactorAnalysis
 from sklearn.preprocessing import StandardScaler
-from util import pickler
+from util import recip_features
 from util.Timer import Timer
 
 ################################################################################
@@ -22,7 +22,7 @@ def trainAndTestModels(year, extension, X=None, Y=None, k=10,
         clf=linear_model.LinearRegression(), transF=None, decomp_func=None):
     timing = Timer('Running regression for %d.%s' % (year, extension))
     if X is None or Y is None:
-        X, Y = pickler.load('Data/Recip-Features/%d.%s' % (year, extension))
+        X, Y, rnodeids = recip_features.load('Data/Recip-Features/%d.%s' % (year, extension))
     if transF: Y = transF(Y)
     timing.markEvent('Loaded X and Y')
     rsquareds = []
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# Script: community_benchmark
+# Compares the community detection methods (snap's CNM against Louvain and label
+# propagation from util/communities) on every saved pruning level of the
+# unipartite graphs: run time, number of communities, modularity, and agreement
+# (normalized mutual information) with CNM.
+# To call from the command line, run `python src/community_benchmark.py <years>`,
+# optionally with `--weightF <weighting>` (jaccard2 by default), `--seed <n>`,
+# and `--no-cnm` to skip CNM on graphs where it is too slow.
+
+import sys, snap
+import numpy as np
+from sklearn.metrics import normalized_mutual_info_score
+from util import pickler, pruned_graphs, communities, cli
+from util.Timer import Timer
+
+################################################################################
+# Module functions #
+################################################################################
+
+# Runs snap.CommunityCNM and returns the array of community labels.
+def getCNMLabels(graph, N):
+    labels = np.arange(N)
+    CmtyV = snap.TCnComV()
+    snap.CommunityCNM(graph, CmtyV)
+    for index, Cmty in enumerate(CmtyV):
+        for nid in Cmty:
+            labels[nid] = N + index
+    return labels
+
+# Runs every method on one pruning level and returns a dictionary from method
+# name to a dictionary of its results.
+def benchmarkLevel(prunedGraphs, kind, value, seed, cnm=True):
+    adj = prunedGraphs.getAdjacency(kind, value, weighted=True)
+    unweightedAdj = prunedGraphs.getAdjacency(kind, value, weighted=False)
+    methods = [
+        ('louvain', lambda: communities.louvain(adj, seed=seed)),
+        ('louvain_unweighted', lambda: communities.louvain(unweightedAdj, seed=seed)),
+        ('label_propagation', lambda: communities.labelPropagation(adj, seed=seed)),
+    ]
+    if cnm:
+        graph = prunedGraphs.getGraph(kind, value)
+        methods.insert(0, ('cnm', lambda: getCNMLabels(graph, prunedGraphs.N)))
+
+    results = {}
+    for method, detect in methods:
+        timing = Timer('%s on %s %f' % (method, kind, value))
+        labels = detect()
+        sizes = np.bincount(np.unique(labels, return_inverse=True)[1])
+        results[method] = {
+            'labels': labels,
+            'time': timing.elapsed(),
+            'communities': int(np.sum(sizes > 1)),
+            'modularity': communities.getModularity(unweightedAdj, labels),
+            'weighted_modularity': communities.getModularity(adj, labels),
+        }
+        timing.finish()
+
+    if cnm:
+        for method in results:
+            results[method]['nmi_cnm'] = normalized_mutual_info_score(
+                    results['cnm']['labels'], results[method]['labels'])
+
+    return results
+
+def printResults(level, results):
+    print '%s:' % level
+    print '  %-20s %10s %12s %10s %10s %8s' % ('method', 'seconds', 'communities', 'Q', 'Q_w', 'NMI_cnm')
+    for method in sorted(results):
+        r = results[method]
+        print '  %-20s %10.2f %12d %10.4f %10.4f %8s' % (method, r['time'], r['communities'],
+                r['modularity'], r['weighted_modularity'],
+                '%.4f' % r['nmi_cnm'] if 'nmi_cnm' in r else '-')
+
+################################################################################
+# Module command-line behavior #
+################################################################################
+
+if __name__ == '__main__':
+    years, options = cli.parseArgs(sys.argv[1:], boolFlags=('no-cnm',))
+    weightF = options.get('weightF', 'jaccard2')
+    seed = int(options.get('seed', 0))
+    cnm = not options.get('no-cnm', False)
+
+    for year in years:
+        timing = Timer('benchmarking community detection for %d %s' % (year, weightF))
+        prunedGraphs = pruned_graphs.load(year, weightF)
+
+        allResults = {}
+        for kind, value in prunedGraphs.getLevels():
+            level = pruned_graphs.getLevelName(year, weightF, kind, value)
+            results = benchmarkLevel(prunedGraphs, kind, value, seed, cnm)
+            printResults(level, results)
+            for method in results:
+                del results[method]['labels']
+            allResults[level] = results
+            timing.markEvent('Benchmarked %s' % level)
+
+        pickler.save(allResults, 'Data/community_benchmark.%d.%s' % (year, weightF))
+        timing.finish()
@@ -2,97 +2,153 @@
 # Module: donor_relationships
 # To call from the command line, run `python src/donor_relationships <years>`, where
 # <years> contains each year whose graph you want to generate.
+#
+# For very large cycles, pass `--approx` to only score the donor pairs found by
+# MinHash/LSH. The approximation is tuned with `--hashes`, `--bands`,
+# `--min-jaccard`, `--max-bucket` and `--recall-sample`, and `--no-rescore` keeps
+# the estimated (instead of exact) Jaccard weights of the surviving pairs.
+#
+# By default every registered weighting is computed; pass e.g.
+# `--metrics jaccard2,cosine` to only compute (and save) some of them. The weight
+# matrices are saved with util.weight_store; `--dtype float32` halves their size
+# on disk.
 
 import snap, math, sys
-from collections import defaultdict
-from util import pickler, graph_funcs
+from util import pickler, graph_funcs, minhash, cli, weight_store, quantile_sketch, donor_aggregates
 from util.Timer import Timer
 import scipy.sparse as sp
 
-# Given an election cycle and a weighting function, creates a unipartite
-# donor-donor graph. The weighting function is described further down in this file.
-def createDonorDonorGraph(year, weightF):
+# Given an election cycle and a list of weighting function names (see
+# weightFunctions below; defaults to all of them), creates a unipartite
+# donor-donor graph and one weight matrix per weighting function. Only the donor
+# infos and precomputed inputs the selected weightings need are computed.
+# If approx is given, it is a dictionary of keyword arguments for getApproxPairs
+# and only the donor pairs found by MinHash/LSH are scored instead of all pairs.
+# Returns the graph, a dictionary from weighting name to weight matrix, and the
+# new-to-old and old-to-new node id mappings.
+def createDonorDonorGraph(year, metrics=None, approx=None):
     timing = Timer('creating donor-donor graph for %d' % year)
+    if metrics is None:
+        metrics = sorted(weightFunctions)
 
     # Load the old bipartite graph graph
     bipartiteGraph = graph_funcs.loadGraph('Data/Bipartite-Graphs/%d.graph' % year)
 
     # Load the info about each donor and their recipients
-    numDonations, totalAmount, cands, transactions, amounts, totalReceipts = getDonorInfos(bipartiteGraph)
+    infos = getWeightInputs(donor_aggregates.load(year, bipartiteGraph), metrics)
+    cands = infos['cands']
     timing.markEvent('Got info about donor nodes')
 
     # Create initial unipartite graph with just nodes and node attributes
     unipartiteGraph, oldToNew, newToOld = cloneBipartiteNodes(bipartiteGraph, cands)
     timing.markEvent('Finished cloning nodes')
 
-    jaccardData = []
-    jaccard2Data = []
-    affinityData = []
-    cosineData = []
-    adamicData = []
-    weightedAdamicData = []
+    if approx is None:
+        pairs = getAllPairs(newToOld, cands, timing)
+    else:
+        pairs = getApproxPairs(newToOld, cands, timing, **approx)
+
+    data = dict((metric, []) for metric in metrics)
     r = []
     c = []
 
     # Add the weighted edges for every relevant pair of donor nodes
+    for newID1, newID2, sharedCands, jaccardEstimate in pairs:
+        oldID1 = newToOld[newID1]
+        oldID2 = newToOld[newID2]
+
+        # Calculate the weights
+        weights = getWeightScores(oldID1, oldID2, sharedCands, infos, metrics)
+        if jaccardEstimate is not None and 'jaccard' in weights:
+            weights['jaccard'] = jaccardEstimate
+
+        r.append(newID1)
+        r.append(newID2)
+        c.append(newID2)
+        c.append(newID1)
+        for metric in metrics:
+            data[metric].append(weights[metric])
+            data[metric].append(weights[metric])
+
+        # Add the edges between the two nodes and their weights
+        unipartiteGraph.AddEdge(newID1, newID2)
+
+    N = len(newToOld)
+    matrices = {}
+    for metric in metrics:
+        matrices[metric] = sp.csr_matrix((data[metric], (r, c)), shape = (N, N))
+
+    timing.finish()
+    return unipartiteGraph, matrices, newToOld, oldToNew
+
+# Generator over every pair of unipartite node ids whose donors share at least
+# one candidate. Yields tuples of the two new ids, their shared candidates, and
+# None (the exact projection has no Jaccard estimate).
+def getAllPairs(newToOld, cands, timing):
+    newIDs = newToOld.keys()
     nodesDone = 0
 
-    for i, newID1 in enumerate(newToOld.keys()):
+    for i, newID1 in enumerate(newIDs):
         oldID1 = newToOld[newID1]
-        for newID2 in newToOld.keys()[i + 1:]:
+        for newID2 in newIDs[i + 1:]:
             oldID2 = newToOld[newID2]
 
             sharedCands = cands[oldID1].intersection(cands[oldID2])
             if not sharedCands: continue
 
-            # Calculate the weight
-            weights = weightF(
-                oldID1,
-                oldID2,
-                sharedCands,
-                numDonations,
-                totalAmount,
-                cands,
-                transactions,
-                amounts,
-                totalReceipts
-            )
-
-            r.append(newID1)
-            r.append(newID2)
-            c.append(newID2)
-            c.append(newID1)
-            jaccardData.append(weights['jaccard'])
-            jaccardData.append(weights['jaccard'])
-            jaccard2Data.append(weights['jaccard2'])
-            jaccard2Data.append(weights['jaccard2'])
-            affinityData.append(weights['affinity'])
-            affinityData.append(weights['affinity'])
-            cosineData.append(weights['cosine'])
-            cosineData.append(weights['cosine'])
-            adamicData.append(weights['adamic'])
-            adamicData.append(weights['adamic'])
-            weightedAdamicData.append(weights['weighted_adamic'])
-            weightedAdamicData.append(weights['weighted_adamic'])
-
-            # Add the edges between the two nodes and their weights
-            unipartiteGraph.AddEdge(newID1, newID2)
+            yield newID1, newID2, sharedCands, None
 
         nodesDone += 1
         if nodesDone % 100 == 0:
             timing.markEvent('Finished %d outer loops out of %d' % \
-                    (nodesDone, unipartiteGraph.GetNodes()))
-
-    N = len(newToOld)
-    jaccardAdjMat = sp.csr_matrix((jaccardData, (r, c)), shape = (N, N))
-    jaccard2AdjMat = sp.csr_matrix((jaccard2Data, (r, c)), shape = (N, N))
-    affinityAdjMat = sp.csr_matrix((affinityData, (r, c)), shape = (N, N))
-    cosineAdjMat = sp.csr_matrix((cosineData, (r, c)), shape = (N, N))
-    adamicAdjMat = sp.csr_matrix((adamicData, (r, c)), shape = (N, N))
-    weightedAdamicAdjMat = sp.csr_matrix((weightedAdamicData, (r, c)), shape = (N, N))
-
-    timing.finish()
-    return unipartiteGraph, jaccardAdjMat, jaccard2AdjMat, affinityAdjMat, cosineAdjMat, adamicAdjMat, weightedAdamicAdjMat, newToOld, oldToNew
+                    (nodesDone, len(newIDs)))
+
+# Approximate alternative to getAllPairs for very large cycles. Computes MinHash
+# signatures of each donor's candidate set, uses LSH banding to find candidate
+# pairs, and keeps the pairs whose estimated Jaccard similarity is at least
+# minJaccard. If rescore is True the survivors are rescored exactly (and dropped
+# if their exact Jaccard falls below minJaccard); otherwise the estimate is
+# yielded alongside the pair to be used as its 'jaccard' weight. The recall
+# against the exact projection is measured on recallSample donors and printed.
+# Returns a list of tuples in the same format getAllPairs yields.
+def getApproxPairs(newToOld, cands, timing, numHashes=100, numBands=20,
+        minJaccard=0.0, rescore=True, maxBucketSize=None, recallSample=1000, seed=0):
+    newIDs = newToOld.keys()
+    oldIDs = [newToOld[newID] for newID in newIDs]
+
+    signatures = minhash.getSignatures(oldIDs, cands, numHashes, seed)
+    timing.markEvent('Computed %d MinHash signatures' % len(oldIDs))
+
+    candidatePairs = minhash.getCandidatePairs(signatures, numBands, maxBucketSize)
+    rows1, rows2 = minhash.decodePairs(candidatePairs, len(oldIDs))
+    estimates = minhash.estimateJaccard(signatures, rows1, rows2)
+    timing.markEvent('Found %d LSH candidate pairs' % len(candidatePairs))
+
+    pairs = []
+    for i, j, estimate in zip(rows1, rows2, estimates):
+        if estimate < minJaccard: continue
+        oldID1 = oldIDs[i]
+        oldID2 = oldIDs[j]
+
+        sharedCands = cands[oldID1].intersection(cands[oldID2])
+        if not sharedCands: continue
+
+        if rescore:
+            exact = float(len(sharedCands)) / len(cands[oldID1].union(cands[oldID2]))
+            if exact < minJaccard: continue
+            estimate = None
+
+        pairs.append((newIDs[i], newIDs[j], sharedCands, estimate))
+    timing.markEvent('Kept %d approximate pairs' % len(pairs))
+
+    if recallSample:
+        approxPairs = set(frozenset((newToOld[p[0]], newToOld[p[1]])) for p in pairs)
+        recall, numExact = minhash.getRecall(oldIDs, cands, approxPairs,
+                minJaccard, recallSample, seed)
+        timing.markEvent('Approximate projection recall: %f (%d exact pairs from %d sampled donors)' \
+                % (recall, numExact, min(recallSample, len(oldIDs))))
+
+    return pairs
 
 # Takes in the bipartite graph and generates the initial unipartiteGraph with just nodes
 # and node attributes.
@@ -114,116 +170,128 @@ def cloneBipartiteNodes(bipartiteGraph, cands, threshold = 2):
 
     return unipartiteGraph, oldToNew, newToOld
 
-# Given a bipartite donor-candidate graph, returns 5 relevant dictionaries
-# from cnodeids to various donation metrics. These are, in order,
-# 1. The total number of donations that donor made
-# 2. The total amount that donor donated
-# 3. The set of rnodeids that donor gave to
-# 4. A dictionary showing how many donations the donor made to each rnodeid
-# 5. A dictionary showing how much the donor gave to each rnodeid
-def getDonorInfos(graph):
-    # Dict from cnodeids to ints showing how many donations this person has made
-    numDonations = defaultdict(int)
-
-    # Dict from cnodeids to ints showing how much money this person has donated
-    totalAmount = defaultdict(int)
-
-    # Dict from cnodeids to set of ints showing which nodes received donations
-    # from this donor
-    cands = defaultdict(set)
-
-    # Dict from cnodeids to dict from rnodeids to ints showing the number of
-    # donations from that donor node to that recipient node
-    transactions = defaultdict(lambda: defaultdict(int))
-
-    # Dict from cnodeids to dict from rnodeids to ints showing the amount
-    # donated by that donor to that recipient
-    amounts = defaultdict(lambda: defaultdict(int))
-
-    # Dict from rnodeids to ints showing the total amount received in
-    # donations by a candidate
-    totalReceipts = defaultdict(int)
-
-    # Add each edge's info to the dicts
-    for edge in graph.Edges():
-        cnodeid = edge.GetSrcNId()
-        rnodeid = edge.GetDstNId()
-        amount = graph.GetIntAttrDatE(edge, 'amount')
-
-        totalReceipts[rnodeid] += amount
-        numDonations[cnodeid] += 1
-        totalAmount[cnodeid] += amount
-        cands[cnodeid].add(rnodeid)
-        transactions[cnodeid][rnodeid] += 1
-        amounts[cnodeid][rnodeid] += amount
-
-    return numDonations, totalAmount, cands, transactions, amounts, totalReceipts
+# ----- PRECOMPUTED INPUTS -----
+
+# Inputs derived from the donor infos (see donor_aggregates.DONOR_INFOS) once,
+# instead of once per donor pair. Each precompute function takes the dictionary
+# of infos and returns the new input.
+
+# Dict from cnodeids to the L2 norm of the amounts given to each recipient
+def getAmountNorms(infos):
+    amounts = infos['amounts']
+    return dict((cnodeid, math.sqrt(sum([amounts[cnodeid][cand] ** 2 for cand in amounts[cnodeid]]))) \
+            for cnodeid in amounts)
+
+# Dict from rnodeids to the base 10 log of the total amount they received
+def getLogReceipts(infos):
+    totalReceipts = infos['totalReceipts']
+    return dict((rnodeid, math.log(totalReceipts[rnodeid], 10)) for rnodeid in totalReceipts)
+
+# Dictionary from precomputed input name to the function computing it and the
+# names of the inputs it needs.
+precomputedInputs = {
+    'amountNorms': (getAmountNorms, ('amounts',)),
+    'logReceipts': (getLogReceipts, ('totalReceipts',)),
+}
+
+# Given the donor aggregates of a bipartite graph and a list of weighting
+# function names, returns the dictionary of donor infos and precomputed inputs
+# those weightings need. 'cands' is always included since the projection itself
+# needs it.
+def getWeightInputs(aggregates, metrics):
+    needed = set(['cands'])
+    for metric in metrics:
+        needed.update(weightFunctions[metric][1])
+
+    # Expand precomputed inputs into the inputs they are computed from
+    pending = [name for name in needed if name in precomputedInputs]
+    while pending:
+        for dep in precomputedInputs[pending.pop()][1]:
+            if dep not in needed:
+                needed.add(dep)
+                if dep in precomputedInputs: pending.append(dep)
+
+    infos = aggregates.getInfos([name for name in donor_aggregates.DONOR_INFOS if name in needed])
+    resolved = set(infos)
+    while len(resolved) < len(needed):
+        for name in needed - resolved:
+            func, deps = precomputedInputs[name]
+            if resolved.issuperset(deps):
+                infos[name] = func(infos)
+                resolved.add(name)
+
+    return infos
 
 # ----- WEIGHTING FUNCTIONS -----
 
-# The weighting function must take in the 2 cnodeids, their shared candidates
-# and the following 5 dictionary parameters, each from cnodeid to:
-# 1. The total number of donations that donor made
-# 2. The total amount that donor donated
-# 3. The set of rnodeids that donor gave to
-# 4. A dictionary showing how many donations the donor made to each rnodeid
-# 5. A dictionary showing how much the donor gave to each rnodeid
+# A weighting function must take in the 2 cnodeids, their shared candidates and
+# the dictionary of donor infos and precomputed inputs described above, and
+# return the weight of the edge between the two donors. It is made available to
+# the projection by registering it in weightFunctions along with the names of
+# the inputs it reads from that dictionary.
 
-def getWeightScores(id1, id2, sharedCands, numDonations, totalAmount, cands, transactions, amounts, totalReceipts):
+# Given the 2 cnodeids, their shared candidates, the dictionary of inputs, and
+# the names of the weighting functions to use, returns a dictionary from
+# weighting name to weight.
+def getWeightScores(id1, id2, sharedCands, infos, metrics):
     weights = {}
-
-    n1, s1 = jaccardSimilarity(id1, id2, sharedCands, numDonations, totalAmount, cands, transactions, amounts, totalReceipts)
-    n2, s2 = jaccardSimilarity2(id1, id2, sharedCands, numDonations, totalAmount, cands, transactions, amounts, totalReceipts)
-    n3, s3 = affinity(id1, id2, sharedCands, numDonations, totalAmount, cands, transactions, amounts, totalReceipts)
-    n4, s4 = cosSim(id1, id2, sharedCands, numDonations, totalAmount, cands, transactions, amounts, totalReceipts)
-    n5, s5 = adamic(id1, id2, sharedCands, numDonations, totalAmount, cands, transactions, amounts, totalReceipts)
-    n6, s6 = weightedAdamic(id1, id2, sharedCands, numDonations, totalAmount, cands, transactions, amounts, totalReceipts)
-
-    weights[n1] = s1
-    weights[n2] = s2
-    weights[n3] = s3
-    weights[n4] = s4
-    weights[n5] = s5
-    weights[n6] = s6
-
+    for metric in metrics:
+        weights[metric] = weightFunctions[metric][0](id1, id2, sharedCands, infos)
     return weights
 
 # Simple Jaccard Similarity
-def jaccardSimilarity(id1, id2, sharedCands, numDonations, totalAmount, cands, transactions, amounts, totalReceipts):
-    score = float(len(sharedCands)) / len(cands[id1].union(cands[id2]))
-    return 'jaccard', score
+def jaccardSimilarity(id1, id2, sharedCands, infos):
+    cands = infos['cands']
+    return float(len(sharedCands)) / len(cands[id1].union(cands[id2]))
 
 # Jaccard Similarity using the intersection of the fraction of total wealth donated to the same candidates:
-def jaccardSimilarity2(id1, id2, sharedCands, numDonations, totalAmount, cands, transactions, amounts, totalReceipts):
+def jaccardSimilarity2(id1, id2, sharedCands, infos):
+    amounts = infos['amounts']
+    totalAmount = infos['totalAmount']
     donationIntersectionAmount = sum([min(amounts[id1][cand], amounts[id2][cand]) for cand in sharedCands])
     denom = (totalAmount[id1] + totalAmount[id2])
     # if (denom == 0):
-    #     return 'jaccard2', 0.0
-    return 'jaccard2', float(donationIntersectionAmount) / denom
+    #     return 0.0
+    return float(donationIntersectionAmount) / denom
 
 # See: https://stats.stackexchange.com/questions/142132/is-this-a-valid-method-for-unipartite-projection-of-a-bipartite-graph
-def affinity(id1, id2, sharedCands, numDonations, totalAmount, cands, transactions, amounts, totalReceipts):
-    score = ((len(sharedCands) * len(cands)) / (len(cands[id1]) + len(cands[id2]))) / 1.0
-    return 'affinity', score
+def affinity(id1, id2, sharedCands, infos):
+    cands = infos['cands']
+    return ((len(sharedCands) * len(cands)) / (len(cands[id1]) + len(cands[id2]))) / 1.0
 
 # Cosine Similarity:
-def cosSim(id1, id2, sharedCands, numDonations, totalAmount, cands, transactions, amounts, totalReceipts):
+def cosSim(id1, id2, sharedCands, infos):
+    amounts = infos['amounts']
+    amountNorms = infos['amountNorms']
     numerator = sum([amounts[id1][cand] * amounts[id2][cand] for cand in sharedCands])
-    denomA = math.sqrt(sum([amounts[id1][cand] ** 2 for cand in amounts[id1]]))
-    denomB = math.sqrt(sum([amounts[id2][cand] ** 2 for cand in amounts[id2]]))
-    score = numerator / (float(denomA) * denomB)
-    return 'cosine', score
+    return numerator / (float(amountNorms[id1]) * amountNorms[id2])
 
 # Adamic Adar Similarity Index:
-def adamic(id1, id2, sharedCands, numDonations, totalAmount, cands, transactions, amounts, totalReceipts):
-    score = sum([ 1.0 / math.log(totalReceipts[cand], 10) for cand in sharedCands])
-    return 'adamic', score
+def adamic(id1, id2, sharedCands, infos):
+    logReceipts = infos['logReceipts']
+    return sum([ 1.0 / logReceipts[cand] for cand in sharedCands])
 
 # Weighted Adamic Adar Similarity Index: (http://www.slideshare.net/hajimesasaki1/picmet15sasaki20150805ppt)
 # <On slide 8>
-def weightedAdamic(id1, id2, sharedCands, numDonations, totalAmount, cands, transactions, amounts, totalReceipts):
-    score = sum([ (amounts[id1][cand] + amounts[id2][cand]) / (1.0 + math.log(totalReceipts[cand], 10)) for cand in sharedCands])
-    return 'weighted_adamic', score
+def weightedAdamic(id1, id2, sharedCands, infos):
+    amounts = infos['amounts']
+    logReceipts = infos['logReceipts']
+    return sum([ (amounts[id1][cand] + amounts[id2][cand]) / (1.0 + logReceipts[cand]) for cand in sharedCands])
+
+# Dictionary from weighting name to the weighting function and the names of the
+# inputs it needs.
+weightFunctions = {}
+
+# Makes a weighting function available to createDonorDonorGraph under name.
+def registerWeightF(name, weightF, inputs):
+    weightFunctions[name] = (weightF, tuple(inputs))
+
+registerWeightF('jaccard', jaccardSimilarity, ('cands',))
+registerWeightF('jaccard2', jaccardSimilarity2, ('amounts', 'totalAmount'))
+registerWeightF('affinity', affinity, ('cands',))
+registerWeightF('cosine', cosSim, ('amounts', 'amountNorms'))
+registerWeightF('adamic', adamic, ('logReceipts',))
+registerWeightF('weighted_adamic', weightedAdamic, ('amounts', 'logReceipts'))
 
 
 ################################################################################
@@ -231,25 +299,38 @@ def weightedAdamic(id1, id2, sharedCands, numDonations, totalAmount, cands, tran
 ################################################################################
 
 if __name__ == '__main__':
+    years, options = cli.parseArgs(sys.argv[1:], boolFlags=('approx', 'no-rescore'))
+    dtype = options.get('dtype', 'float64')
+    metrics = cli.parseList(options.get('metrics'))
+
+    approx = None
+    if options.get('approx'):
+        approx = {
+            'numHashes': int(options.get('hashes', 100)),
+            'numBands': int(options.get('bands', 20)),
+            'minJaccard': float(options.get('min-jaccard', 0.0)),
+            'rescore': not options.get('no-rescore', False),
+            'maxBucketSize': int(options.get('max-bucket', 0)) or None,
+            'recallSample': int(options.get('recall-sample', 1000)),
+        }
+
     overallTiming = Timer('all unipartite graphs')
-    for arg in sys.argv[1:]:
-        year = int(arg)
+    for year in years:
         timing = Timer('Creating unipartite graph for %d' % year)
 
-        graph, wmat1, wmat2, wmat3, wmat4, wmat5, wmat6, newToOld, oldToNew = createDonorDonorGraph(year, getWeightScores)
+        graph, matrices, newToOld, oldToNew = createDonorDonorGraph(year, metrics, approx)
 
         # Save the SNAP graph:
         outfile = 'Data/Unipartite-Graphs/%d.graph' % year
         graph_funcs.saveGraph(graph, outfile)
 
-        # Save the weight matrices:
-        matrixPrefix = 'Data/Unipartite-Matrix/%d' % year
-        pickler.save(wmat1, matrixPrefix + '.jaccard')
-        pickler.save(wmat2, matrixPrefix + '.jaccard2')
-        pickler.save(wmat3, matrixPrefix + '.affinity')
-        pickler.save(wmat4, matrixPrefix + '.cosine')
-        pickler.save(wmat5, matrixPrefix + '.adamic')
-        pickler.save(wmat6, matrixPrefix + '.weighted_adamic')
+        # Save the weight matrices (one shared structure plus a value column each):
+        weight_store.saveMatrices(year, matrices, dtype)
+
+        # Save a small quantile sketch of each weighting's weights, used by
+        # unigraph_pruner to resolve quantile thresholds:
+        for metric in matrices:
+            quantile_sketch.saveSummary(year, metric)
 
         # Save the bipartite-unipartite corresponding node ID dictionaries:
         mappingPrefix = 'Data/Unipartite-NodeMappings/%d' % year
@@ -4,179 +4,230 @@
 # <years> contains each year whose graph you want to generate.
 
 import sys, snap
-import scipy.sparse as sp
-import scipy.sparse.linalg as linalg
-from util import pickler, graph_funcs, categorical
+from util import pickler, graph_funcs, weight_store, donor_aggregates, graph_analytics, communities, cli
+from util import feature_matrix
 from util.Timer import Timer
 from collections import defaultdict
 import numpy as np
 
 
-def generateFeatures(year, bipartite, unipartite, newToOldIDs, adjMatrix):
+# If the unipartite graph is one of a series of nested pruned graphs, growth is
+# the graph_analytics.GraphGrowth already updated with its edges, from which the
+# degree, average weight, component and PageRank features are taken.
+# The bipartite features (see extractBipartiteFeatures), which are the same for
+# every unipartite graph of the year, can be passed in if already computed.
+# featureNames are the unipartite features to generate (see unipartiteFeatures).
+# Returns the donor features as a util.feature_matrix.FeatureMatrix, with one row
+# per donor of the bipartite graph.
+def generateFeatures(year, bipartite, unipartite, newToOldIDs, adjMatrix, communityMethod=None, growth=None,
+        bipartiteFeatures=None, featureNames=None):
     timing = Timer('generating features for %d' % year)
 
-    bipartiteFeatures = extractBipartiteFeatures(bipartite)
-    timing.markEvent('Extracted bipartite features.')
+    if bipartiteFeatures is None:
+        aggregates = donor_aggregates.load(year, bipartite)
+        bipartiteFeatures = extractBipartiteFeatures(bipartite, aggregates=aggregates)
+        timing.markEvent('Extracted bipartite features.')
 
-    # rawUnifeatures, componentFeatureFunc, communityFeatureFuncn = extractUnipartiteFeatures(unipartite, adjMatrix)
-    rawUnifeatures, componentFeatureFunc, CNMFeatureFunc = extractUnipartiteFeatures(unipartite, adjMatrix)
-    unipartiteFeatures = convertNewToOldIDs(rawUnifeatures, newToOldIDs)
+    if featureNames is None:
+        featureNames = unipartiteFeatureNames
+    rawUnifeatures = extractUnipartiteFeatures(unipartite, adjMatrix, featureNames,
+            communityMethod=communityMethod, growth=growth)
     timing.markEvent('Extracted unipartite features.')
 
-    # append unipartite features to bipartite features for each node, returning combined feature dictionary.
-    # If the donor is not in the unipartite feature graph then we just take the default values (since the
-    # node falls below the unipartite threshold from sqlToGraphs):
-    features = {}
-    for donorNode in graph_funcs.getDonors(bipartite):
-        oldNID = donorNode.GetId()
-        if oldNID in unipartiteFeatures:
-            features[oldNID] = bipartiteFeatures[oldNID] + unipartiteFeatures[oldNID]
-        else:
-            features[oldNID] = bipartiteFeatures[oldNID] + defaultUnipartiteFeatures(componentFeatureFunc, CNMFeatureFunc) #, communityFeatureFuncn)
+    # fill in the unipartite features next to the bipartite features in each donor's row, returning the
+    # combined feature matrix. If the donor is not in the unipartite feature graph then we just take the
+    # default values (since the node falls below the unipartite threshold from sqlToGraphs):
+    donorIDs = [donorNode.GetId() for donorNode in graph_funcs.getDonors(bipartite)]
+    columns = getBipartiteFeatureNames() + list(featureNames)
+    numBipartite = len(columns) - len(featureNames)
+
+    X = np.empty((len(donorIDs), len(columns)))
+    X[:, :numBipartite] = np.array([bipartiteFeatures[oldNID] for oldNID in donorIDs]).reshape(-1, numBipartite)
+    X[:, numBipartite:] = defaultUnipartiteFeatures(featureNames)
+    donorRows = dict(zip(donorIDs, range(len(donorIDs))))
+    for node in unipartite.Nodes():
+        newNID = node.GetId()
+        if newToOldIDs[newNID] in donorRows:
+            X[donorRows[newToOldIDs[newNID]], numBipartite:] = rawUnifeatures[newNID]
     timing.finish()
 
-    return features
-
-
-def extractBipartiteFeatures(bipartiteGraph):
+    return feature_matrix.FeatureMatrix(X, np.array(donorIDs, dtype=np.int64), columns)
+
+
+# Per-recipient attributes that donor features can aggregate over. Each is a
+# function from the bipartite graph and an rnodeid to a number, and is evaluated
+# once per recipient rather than once per donation.
+recipientAttributes = {
+    'dem': lambda graph, rid: 1.0 if graph.GetIntAttrDatN(rid, 'party') == 1 else 0.0,
+    'incumbent': lambda graph, rid: 1.0 if graph.GetIntAttrDatN(rid, 'incumb') == 1 else 0.0,
+    'hasCfs': lambda graph, rid: 1.0 if graph.GetIntAttrDatN(rid, 'IsRecip') == 1 else 0.0,
+    'cfs': lambda graph, rid: graph.GetFltAttrDatN(rid, 'cfs') \
+            if graph.GetIntAttrDatN(rid, 'IsRecip') == 1 else 0.0,
+}
+
+# Amount-weighted donor features over recipient attributes. Each is a tuple of
+# the feature name, the attribute summed over the donor's donations (weighted
+# by amount), and the attribute whose amount-weighted sum it is divided by (None
+# divides by the donor's total amount).
+amountWeightedFeatures = [
+    ('percent_dem', 'dem', None),
+    ('percent_incumbent', 'incumbent', None),
+    ('mean_recip_cfs', 'cfs', 'hasCfs'),
+]
+
+# Returns the names of the bipartite features extractBipartiteFeatures returns
+# for weightedFeatures, in order.
+def getBipartiteFeatureNames(weightedFeatures=('percent_dem',)):
+    return ['total_amount', 'num_cands'] + \
+            [name for name, numerAttr, denomAttr in amountWeightedFeatures if name in weightedFeatures]
+
+# Returns the dictionary from cnodeid to bipartite feature vector: the total
+# amount donated, the number of recipients donated to, and the amount-weighted
+# features (see amountWeightedFeatures) named in weightedFeatures. All of the
+# amount-weighted features come out of a single sparse product of the donation
+# matrix with the matrix of recipient attributes. The graph's donor aggregates
+# (see util.donor_aggregates) are computed from it if not passed in.
+def extractBipartiteFeatures(bipartiteGraph, weightedFeatures=('percent_dem',), aggregates=None):
 
     features = defaultdict(list)
-    numDonations, totalAmount, cands, transactions, amounts = getDonorInfos(bipartiteGraph)
+    if aggregates is None:
+        aggregates = donor_aggregates.fromGraph(bipartiteGraph)
+    amounts = aggregates.getMatrix()
+    recipIDs = aggregates.recips
+
+    # Recipient x attribute matrix for just the attributes we need
+    selected = [f for f in amountWeightedFeatures if f[0] in weightedFeatures]
+    attrs = sorted(set([f[1] for f in selected] + [f[2] for f in selected if f[2]]))
+    recipAttrs = np.array([[recipientAttributes[attr](bipartiteGraph, rid) for attr in attrs] \
+            for rid in recipIDs.tolist()]).reshape(len(recipIDs), len(attrs))
+
+    # Donor x attribute matrix of amount-weighted attribute sums
+    weightedSums = amounts.dot(recipAttrs)
+    totalAmounts = aggregates.getTotalAmounts()
+    numCands = np.diff(amounts.indptr)
+    donorRows = aggregates.getDonorIndex()
 
     for node in graph_funcs.getDonors(bipartiteGraph):
         nid = node.GetId()
+        row = donorRows[nid]
 
         # Total amount donated:
-        features[nid].append(totalAmount[nid])
+        features[nid].append(int(totalAmounts[row]))
 
         # Total number of candidates donated to (MULTICOLLINEARITY WARNING):
-        features[nid].append(len(cands[nid]))
+        features[nid].append(int(numCands[row]))
 
-        # Percent of donations to Democrats:
-        demRecipIDs = [rid for rid in cands[nid] if (bipartiteGraph.GetIntAttrDatN(rid, 'party') == 1)]
-        amountToDems = sum([amounts[nid][rid] for rid in demRecipIDs])
-        features[nid].append(amountToDems / float(totalAmount[nid]))
+        # Amount-weighted recipient attributes (e.g. percent of donations to Democrats):
+        for name, numerAttr, denomAttr in selected:
+            numer = weightedSums[row, attrs.index(numerAttr)]
+            if denomAttr is None:
+                features[nid].append(numer / float(totalAmounts[row]))
+            else:
+                denom = weightedSums[row, attrs.index(denomAttr)]
+                features[nid].append(numer / denom if denom else 0.0)
 
     return features
 
-# Returns both the dictionary from unipartite node id to feature vector AND the categorical
-# feature func for connected component ID.
-# TODO: Fix this decomp.
-def extractUnipartiteFeatures(unipartiteGraph, adjMat):
-    timing = Timer('extracting unipartite features')
-
-    features = defaultdict(list)
-    #componentFeatureFunc, communityFeatureFuncn, idToCommunity = getUnipartiteSurfaceFeatures(unipartiteGraph, adjMat, features)
-    componentFeatureFunc, CNMFeatureFunc, idToCNM = getUnipartiteSurfaceFeatures(unipartiteGraph, adjMat, features)
-
-    timing.markEvent('1. Extracted surface features')
-
-    # Average weight of edges:
-    avgWeights = calcAverageWeights(unipartiteGraph, adjMat)
-    #totalWeights = {adjMat
-    timing.markEvent('2. Computed average weights.')
-
-    # Size of connected component:
-    #cnctComponents = calcCnctComponents(unipartiteGraph)
-    timing.markEvent('3. Computed connected components.')
-
-    # Size of CNM community:
-    communities = calcCommunities(idToCNM)
-    timing.markEvent('4. Computed CNM communities.')
-
-    # Pagerank:
-    pageRanks = snap.TIntFltH()
-    snap.GetPageRank(unipartiteGraph, pageRanks)
-    timing.markEvent('5. Computed PageRank.')
-
-    # combine the graph wide features with the existing surface features:
-    for nid in features:
-        features[nid].append(avgWeights[nid])
-        #features[nid].append(cnctComponents[nid])
-        features[nid].append(communities[nid])
-        features[nid].append(pageRanks[nid])
-
-    timing.finish()
-
-    return features, componentFeatureFunc, CNMFeatureFunc
-
-# Takes the graph and adjacency matrix, and uses these to update the
-# features map for the unipartite graph.
-# Returns the categorical feature function (from connected component ID to dummy feature vec).
-# TODO: Improve this style.
-def getUnipartiteSurfaceFeatures(graph, adjMat, features):
-
-    # Cateogrical connected component labels:
-    idToCC = labelConnectedComponents(graph)
-    featureFunc1 = lambda x: 0.0 if x not in idToCC else idToCC[x]
-    componentFeatureFunc = categorical.getCategoricalFeatureVec(featureFunc1, graph.Nodes())
-
-    idToCNM = labelCNMCommunity(graph)
-    featureFunc2 = lambda x: 0.0 if x not in idToCNM else idToCNM[x]
-    CNMFeatureFunc = categorical.getCategoricalFeatureVec(featureFunc2, graph.Nodes())
-
-    # idToCommunity = labelCommunities(graph)
-    # featureFunc = lambda x: 0.0 if x not in idToCommunity else idToCommunity[x]
-    # communityFeatureFunc = categorical.getCategoricalFeatureVec(featureFunc, graph.Nodes())
-
-    for node in graph.Nodes():
-        nid = node.GetId()
-
-        # Node degree:
-        features[nid].append(node.GetDeg())
-
-        # Nodes at hop:
-        # nodesAtHop = snap.TIntV()
-        # features[nid].append(snap.GetNodesAtHop(graph, nid, 2, nodesAtHop, False))
-
-        # Connected component category features:
-        #features[nid] += componentFeatureFunc(idToCC[nid]).tolist()
-
-        # CNM community category features:
-        #features[nid] += CNMFeatureFunc(idToCNM[nid]).tolist()
-
-    return componentFeatureFunc, CNMFeatureFunc, idToCNM #, communityFeatureFunc, idToCommunitiy
-
-def calcAverageWeights(graph, adjMat):
-    neighbors = defaultdict(list)
-    timing = Timer('Calculating average weights')
-    # Get all the nodes that a node borders in the graph
-    for edge in graph.Edges():
-        nodeid1 = edge.GetSrcNId()
-        nodeid2 = edge.GetDstNId()
-        neighbors[nodeid1].append(nodeid2)
-        neighbors[nodeid2].append(nodeid1)
-    timing.markEvent('Gotten all neighbors')
-
-    # Get the average weight per node connected to
-    weights = {}
-    i = 0
-    for nodeid in neighbors:
-        rows = neighbors[nodeid]
-        weights[nodeid] = adjMat[rows, nodeid].sum() / float(len(rows))
-        i += 1
-        if i % 1000 == 0:
-            timing.markEvent('Done with %d out of %d' % (i, len(neighbors)))
-
-    return weights
-
-# Efficiently computes the connected components of the graph returning
-# a dictionary: { nid -> lenComp }
-def calcCnctComponents(graph):
-    lenComps = {}
-    CnCom = snap.TIntV()
-    for node in graph.Nodes():
-        nodeid = node.GetId()
-        if nodeid in lenComps:
-            continue
-        snap.GetNodeWcc(graph, nodeid, CnCom)
-        l = CnCom.Len()
-        lenComps[nodeid] = l
-        for conNode in CnCom:
-            lenComps[conNode] = l
-
-    return lenComps
-
+# The intermediate results the unipartite features are computed from, each
+# registered with registerInput under a name with the function computing it and
+# the names of the inputs it is computed from (passed to it in order). The base
+# inputs are given for each graph (see UnipartiteInputs):
+# 'graph': the snap.TUNGraph, 'N': its number of node ids, 'adjMat': the weight
+# matrix, 'growth': the graph_analytics.GraphGrowth holding its edges if it is
+# one of a series of nested pruned graphs (otherwise None), 'communityMethod':
+# one of communityLabelers, and 'pageRankStart': a PageRank vector to warm start
+# from (or None).
+graphInputs = {}
+
+def registerInput(name, f, inputs):
+    graphInputs[name] = (f, inputs)
+
+# The unipartite donor features, each registered with registerFeature under a
+# name with the function computing it, the names of the inputs it is computed
+# from, and its default value for donors that aren't in the unipartite graph.
+# Each function returns an array with the feature's value for every node id.
+unipartiteFeatures = {}
+
+def registerFeature(name, f, inputs, default):
+    unipartiteFeatures[name] = (f, inputs, default)
+
+# The inputs of one unipartite graph. Each input is computed the first time it
+# is asked for (along with the inputs it depends on) and then cached, so the
+# features of a graph share their intermediate results. If a Timer is given, an
+# event is marked on it for each input computed.
+class UnipartiteInputs:
+    def __init__(self, graph, adjMat, growth=None, communityMethod=None, pageRankStart=None, timing=None):
+        self.cache = {
+            'graph': graph,
+            'N': adjMat.shape[0],
+            'adjMat': adjMat,
+            'growth': growth,
+            'communityMethod': communityMethod or COMMUNITY_METHOD,
+            'pageRankStart': pageRankStart,
+        }
+        self.timing = timing
+
+    def get(self, name):
+        if name not in self.cache:
+            f, inputs = graphInputs[name]
+            self.cache[name] = f(*[self.get(inputName) for inputName in inputs])
+            if self.timing is not None:
+                self.timing.markEvent('Computed %s' % name)
+        return self.cache[name]
+
+# The unweighted adjacency matrix of the graph (see util/graph_analytics), and
+# the same with the graph's edges weighted by the weight matrix.
+registerInput('adjacency', lambda graph, N, growth: \
+        growth.getAdjacency() if growth is not None else graph_analytics.fromGraph(graph, N),
+        ('graph', 'N', 'growth'))
+registerInput('weighted_adjacency', lambda adj, adjMat: adj.multiply(adjMat).tocsr(),
+        ('adjacency', 'adjMat'))
+
+registerInput('degrees', lambda adj, growth: \
+        growth.degrees if growth is not None else graph_analytics.getDegrees(adj),
+        ('adjacency', 'growth'))
+registerInput('strengths', lambda weightedAdj, growth: \
+        growth.strengths if growth is not None else graph_analytics.getStrengths(weightedAdj),
+        ('weighted_adjacency', 'growth'))
+
+# The connected component labels, numbered from 0 in order of each component's
+# smallest node id.
+registerInput('components', lambda adj, growth: \
+        growth.components if growth is not None else graph_analytics.getConnectedComponents(adj)[1],
+        ('adjacency', 'growth'))
+
+# The dictionary from node id to community index (see communityLabelers).
+registerInput('communities', lambda graph, weightedAdj, communityMethod: \
+        communityLabelers[communityMethod](graph, weightedAdj),
+        ('graph', 'weighted_adjacency', 'communityMethod'))
+
+# The number of triangles each node is in (computed in memory-capped blocks of
+# rows, see graph_analytics.getTriangles).
+registerInput('triangles', graph_analytics.getTriangles, ('adjacency',))
+
+# The eigenvector centrality and the spectral embedding (SPECTRAL_DIMS columns)
+# of the weighted graph's giant component, solved with sparse eigensolvers (see
+# util/graph_analytics).
+SPECTRAL_DIMS = 2
+registerInput('eigenvector', lambda weightedAdj, growth: \
+        growth.getEigenvectorCentrality(weightedAdj) if growth is not None \
+        else graph_analytics.getEigenvectorCentrality(weightedAdj),
+        ('weighted_adjacency', 'growth'))
+registerInput('spectral_embedding', lambda weightedAdj, growth: \
+        growth.getSpectralEmbedding(weightedAdj, SPECTRAL_DIMS) if growth is not None \
+        else graph_analytics.getSpectralEmbedding(weightedAdj, SPECTRAL_DIMS)[0],
+        ('weighted_adjacency', 'growth'))
+
+registerInput('pagerank', lambda adj, growth, pageRankStart: \
+        growth.getPageRank(adj) if growth is not None else graph_analytics.getPageRank(adj, start=pageRankStart),
+        ('adjacency', 'growth', 'pageRankStart'))
+
+# Returns the average weight of the edges of each node (0 for nodes without edges).
+def calcAverageWeights(degrees, strengths):
+    averages = np.zeros(len(degrees))
+    nodeids = np.flatnonzero(degrees)
+    averages[nodeids] = strengths[nodeids] / degrees[nodeids]
+    return averages
 
 # Returns the sizes of the communities as a map from node id to size
 def calcCommunities(idToCommunity):
@@ -191,91 +242,81 @@ def calcCommunities(idToCommunity):
 
     return lenCommunities
 
-# Given a bipartite donor-candidate graph, returns 5 relevant dictionaries
-# from cnodeids to various donation metrics. These are, in order,
-# 1. The total number of donations that donor made
-# 2. The total amount that donor donated
-# 3. The set of rnodeids that donor gave to
-# 4. A dictionary showing how many donations the donor made to each rnodeid
-# 5. A dictionary showing how much the donor gave to each rnodeid
-def getDonorInfos(graph):
-    # Dict from cnodeids to ints showing how many donations this person has made
-    numDonations = defaultdict(int)
-
-    # Dict from cnodeids to ints showing how much money this person has donated
-    totalAmount = defaultdict(int)
-
-    # Dict from cnodeids to set of ints showing which nodes received donations
-    # from this donor
-    cands = defaultdict(set)
-
-    # Dict from cnodeids to dict from rnodeids to ints showing the number of
-    # donations from that donor node to that recipient node
-    transactions = defaultdict(lambda: defaultdict(int))
-
-    # Dict from cnodeids to dict from rnodeids to ints showing the amount
-    # donated by that donor to that recipient
-    amounts = defaultdict(lambda: defaultdict(int))
-
-    # Add each edge's info to the dicts
-    for edge in graph.Edges():
-        cnodeid = edge.GetSrcNId()
-        rnodeid = edge.GetDstNId()
-        amount = graph.GetIntAttrDatE(edge, 'amount')
-
-        numDonations[cnodeid] += 1
-        totalAmount[cnodeid] += amount
-        cands[cnodeid].add(rnodeid)
-        transactions[cnodeid][rnodeid] += 1
-        amounts[cnodeid][rnodeid] += amount
-
-    return numDonations, totalAmount, cands, transactions, amounts
-
-# Takes in the { unipartiteNodeIDs -> [features] } and newToOldID mapping
-# and returns { bipartiteNodeIDs -> [features] }.
-def convertNewToOldIDs(newIDFeatureMapping, newToOldIDs):
-    oldIDFeatureMapping = {}
-
-    for newID in newIDFeatureMapping:
-        oldIDFeatureMapping[newToOldIDs[newID]] = newIDFeatureMapping[newID]
-
-    return oldIDFeatureMapping
-
-# The default unipartite features for a node not in the unipartite graph:
-def defaultUnipartiteFeatures(componentFeatureFunc, CNMFeatureFunc): #, communityFeatureFunc):
-    defaultFeatures = []
-    defaultFeatures.append(0.0) # degree
-    # defaultFeatures.append() # nodes at hop 2
-    #defaultFeatures += componentFeatureFunc(0).tolist() # connected component category
-    #defaultFeatures += CNMFeatureFunc(0).tolist() # CNM community category
-    defaultFeatures.append(0) # avg. weight of edges
-    #defaultFeatures.append(1.0) # size of connected component
-    defaultFeatures.append(1.0) # size of CNM community
-    # defaultFeatures.append(0.0) # clustering coefficient
-    # defaultFeatures.append(0.0) # eigenvector value
-    defaultFeatures.append(0.0) # pagerank score
-    return defaultFeatures
+# Returns the array of the size of each node's community, given the dictionary
+# from node id to community index and the number of node ids.
+def calcCommunitySizes(idToCommunity, N):
+    lenCommunities = calcCommunities(idToCommunity)
+    return np.array([lenCommunities.get(nid, 1.0) for nid in xrange(N)], dtype=np.float64)
+
+# Node degree:
+registerFeature('degree', lambda degrees: degrees, ('degrees',), 0.0)
+# Average weight of edges:
+registerFeature('avg_weight', calcAverageWeights, ('degrees', 'strengths'), 0)
+# Size of connected component:
+registerFeature('component_size', graph_analytics.getComponentSizes, ('components',), 1.0)
+# Size of community:
+registerFeature('community_size', calcCommunitySizes, ('communities', 'N'), 1.0)
+# Nodes at hop 2:
+registerFeature('nodes_at_hop_2', graph_analytics.getNodesAtHop2, ('adjacency',), 0.0)
+# Triangles and clustering coefficient:
+registerFeature('triangles', lambda triangles: triangles, ('triangles',), 0.0)
+registerFeature('clustering', lambda adj, triangles, degrees: graph_analytics.getClustering(adj, triangles, degrees),
+        ('adjacency', 'triangles', 'degrees'), 0.0)
+# Eigenvector value:
+registerFeature('eigenvector', lambda centrality: centrality, ('eigenvector',), 0.0)
+# Spectral embedding coordinates (spectral_0, spectral_1, ...):
+for dim in range(SPECTRAL_DIMS):
+    registerFeature('spectral_%d' % dim, lambda embedding, dim=dim: embedding[:, dim],
+            ('spectral_embedding',), 0.0)
+# Pagerank:
+registerFeature('pagerank', lambda ranks: ranks, ('pagerank',), 0.0)
+
+# The unipartite features generated by default, in order:
+unipartiteFeatureNames = ['degree', 'avg_weight', 'community_size', 'pagerank']
+
+# Returns the N x len(featureNames) array of the unipartite features named in
+# featureNames (unipartiteFeatureNames by default) for every node id of the
+# unipartite graph, computing only the inputs those features need (see
+# UnipartiteInputs for the other arguments).
+def extractUnipartiteFeatures(unipartiteGraph, adjMat, featureNames=None, pageRankStart=None,
+        communityMethod=None, growth=None):
+    timing = Timer('extracting unipartite features')
+    if featureNames is None:
+        featureNames = unipartiteFeatureNames
+
+    inputs = UnipartiteInputs(unipartiteGraph, adjMat, growth, communityMethod, pageRankStart, timing)
+    features = np.empty((adjMat.shape[0], len(featureNames)))
+    for col, name in enumerate(featureNames):
+        f, inputNames, default = unipartiteFeatures[name]
+        features[:, col] = f(*[inputs.get(inputName) for inputName in inputNames])
+        timing.markEvent('Computed %s' % name)
+
+    timing.finish()
+    return features
+
+# The default unipartite features (see unipartiteFeatures) for a node not in the
+# unipartite graph:
+def defaultUnipartiteFeatures(featureNames=None):
+    if featureNames is None:
+        featureNames = unipartiteFeatureNames
+    return [unipartiteFeatures[name][2] for name in featureNames]
 
 # Creates a dictionary from node id to connected component index for a given graph.
-def labelConnectedComponents(graph):
+# Components are numbered from 1 in order of their smallest node id, and nodes
+# with no edges get 0.0. Labels already computed (numbered from 0 the same way)
+# can be passed in.
+def labelConnectedComponents(graph, adj=None, labels=None):
+    if labels is None:
+        if adj is None:
+            adj = graph_analytics.fromGraph(graph)
+        numComponents, labels = graph_analytics.getConnectedComponents(adj)
+    sizes = graph_analytics.getComponentSizes(labels).tolist()
+    labels = labels.tolist()
 
     components = {}
-    CnCom = snap.TIntV()
-    component = 1
-
     for node in graph.Nodes():
         nodeid = node.GetId()
-
-        if nodeid in components:
-            continue
-
-        snap.GetNodeWcc(graph, nodeid, CnCom)
-        if len(CnCom) == 1:
-            components[nodeid] = 0.0
-        else:
-            for cnid in CnCom:
-                components[cnid] = component
-        component += 1
+        components[nodeid] = 0.0 if sizes[nodeid] == 1 else labels[nodeid] + 1
 
     return components
 
@@ -297,6 +338,20 @@ def labelCommunities(graph):
 
     return communities
 
+# The community detection methods for the community features: each takes the
+# graph and its weighted adjacency matrix and returns a dictionary from node id
+# to community index. Louvain and label propagation run on the adjacency matrix
+# (see util/communities) with a fixed seed, so features are repeatable.
+COMMUNITY_METHOD = 'louvain'
+COMMUNITY_SEED = 0
+communityLabelers = {
+    'cnm': lambda graph, adj: labelCNMCommunity(graph),
+    'louvain': lambda graph, adj: communities.toCommunityDict(
+            communities.louvain(adj, seed=COMMUNITY_SEED)),
+    'label_propagation': lambda graph, adj: communities.toCommunityDict(
+            communities.labelPropagation(adj, seed=COMMUNITY_SEED)),
+}
+
 # Clauset-Newman-Moore community detection: returns dictionary form nide id to community index
 def labelCNMCommunity(graph):
 
@@ -321,8 +376,13 @@ def labelCNMCommunity(graph):
 ################################################################################
 
 if __name__ == '__main__':
-    for arg in sys.argv[1:]:
-        year = int(arg)
+    # Pass --communities <method> to pick the community detection method (one of
+    # communityLabelers, louvain by default), and --features <names> to pick the
+    # unipartite features (see unipartiteFeatures, e.g. degree,component_size).
+    years, options = cli.parseArgs(sys.argv[1:])
+    communityMethod = options.get('communities', COMMUNITY_METHOD)
+    featureNames = cli.parseList(options.get('features'), default=unipartiteFeatureNames)
+    for year in years:
         timing = Timer('creating unipartite graph for %d' % year)
 
         bipartiteGraph = graph_funcs.loadGraph('Data/Bipartite-Graphs/%d.graph' % year)
@@ -333,11 +393,12 @@ if __name__ == '__main__':
         #for weightF in ['jaccard', 'affinity', 'jaccard2', 'cosine', 'adamic', 'weighted_adamic']:
         for weightF in ['jaccard2']:
             print '******* %s *******' % weightF
-            adjMatrix = pickler.load('Data/Unipartite-Matrix/%d.%s' % (year, weightF))
+            adjMatrix = weight_store.loadMatrix(year, weightF)
             adjMatrix = adjMatrix.tocsc()
 
-            features = generateFeatures(year, bipartiteGraph, unipartiteGraph, newToOldIDs, adjMatrix)
-            pickler.save(features, 'Data/Features/%d%s.features' % (year, weightF))
+            features = generateFeatures(year, bipartiteGraph, unipartiteGraph, newToOldIDs, adjMatrix,
+                    communityMethod, featureNames=featureNames)
+            feature_matrix.save(features, 'Data/Features/%d%s' % (year, weightF))
 
             timing.markEvent('Processed %s weight function' % weightF)
 
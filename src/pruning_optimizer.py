@@ -4,92 +4,208 @@
 # Yields the pruned unigraph with the highest average KFold r^2 with OLS and
 # no factor decomposition
 
-import sys, snap, feature_extractor, recip_feature_extractor, cfscore_predictions
-from os import listdir
-from util import pickler, graph_funcs
+import sys, os, snap, resource, multiprocessing, feature_extractor, recip_feature_extractor, cfscore_predictions
+from os import listdir, path
+from util import pickler, graph_funcs, weight_store, pruned_graphs, donor_aggregates, graph_analytics, cli
+from util import feature_matrix, recip_features
 from util.Timer import Timer
 import numpy as np
 
-# Get all the pruned unipartite graph files with this weight function
-def getGraphFiles(year, weightF):
-    return [f for f in listdir('Data/Unipartite-Graphs/') \
-            if f.startswith('%d.%s_' % (year, weightF))]
+# Loads the pruned edges (see util.pruned_graphs) for this weight function, or
+# returns None if they haven't been generated.
+def loadPrunedGraphs(year, weightF):
+    if not path.exists('%s/%d.%s.cuts' % (pruned_graphs.EDGES_DIR, year, weightF)):
+        return None
+    return pruned_graphs.load(year, weightF)
+
+# Get the names of all the pruning levels of the unipartite graph with this
+# weight function: the levels saved with its pruned edges, followed by any other
+# pruned graphs saved as snap graph files.
+def getPruningLevels(year, weightF, prunedGraphs=None):
+    if prunedGraphs is None:
+        prunedGraphs = loadPrunedGraphs(year, weightF)
+
+    levels = []
+    if prunedGraphs is not None:
+        levels = [pruned_graphs.getLevelName(year, weightF, kind, value) \
+                for kind, value in prunedGraphs.getLevels()]
+
+    for f in sorted(listdir('Data/Unipartite-Graphs/')):
+        if f.startswith('%d.%s_' % (year, weightF)) and f.endswith('.graph') \
+                and f[:-len('.graph')] not in levels:
+            levels.append(f[:-len('.graph')])
+
+    return levels
+
+# Returns the pruned unipartite graph for a pruning level, materialized from the
+# pruned edges when it is one of their levels and loaded from its snap graph
+# file otherwise.
+def loadUnigraph(year, weightF, level, prunedGraphs=None):
+    if prunedGraphs is not None:
+        for kind, value in prunedGraphs.getLevels():
+            if pruned_graphs.getLevelName(year, weightF, kind, value) == level:
+                return prunedGraphs.getGraph(kind, value)
+    return graph_funcs.loadGraph('Data/Unipartite-Graphs/%s.graph' % level, snap.TUNGraph)
+
+# The inputs shared by the donor features of every pruning level, set by
+# genDonorFeatures before the worker processes are forked so that the workers
+# share them copy-on-write instead of each loading their own.
+sharedInputs = {}
+
+# Returns the peak resident memory of this process so far, in MB.
+def getPeakMemory():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+# Generates and saves the donor features of one pruning level from sharedInputs,
+# in a worker process. Returns the level, the worker's pid, the time taken in
+# seconds, and the worker's peak memory in MB.
+def genLevelFeatures(level):
+    timing = Timer('Generating donor features for %s' % level)
+    year, weightF = sharedInputs['year'], sharedInputs['weightF']
+
+    unigraph = loadUnigraph(year, weightF, level, sharedInputs['prunedGraphs'])
+    features = feature_extractor.generateFeatures(year, sharedInputs['bigraph'], unigraph,
+            sharedInputs['newToOldIDs'], sharedInputs['adjMat'],
+            bipartiteFeatures=sharedInputs['bipartiteFeatures'])
+    feature_matrix.save(features, 'Data/Features/%s' % level)
+
+    elapsed = timing.elapsed()
+    timing.finish()
+    return level, os.getpid(), elapsed, getPeakMemory()
+
+# Given the (level, pid, seconds, peak MB) results of genLevelFeatures, prints
+# the time taken by each level and the peak memory of each worker.
+def printWorkerReport(results):
+    print 'Donor features worker report:'
+    peaks = {}
+    for level, pid, elapsed, peak in sorted(results):
+        print '%-40s worker %-6d %10.2fs %10.1f MB' % (level, pid, elapsed, peak)
+        peaks[pid] = max(peak, peaks.get(pid, 0))
+    for pid in sorted(peaks):
+        print 'Worker %d peak memory: %.1f MB' % (pid, peaks[pid])
 
 # Saves the donor features for all the pruned graphs with this weight function.
-def genDonorFeatures(year, weightF, graphFiles=None, bigraph=None, adjMat=None, newToOldIDs=None):
+# The bipartite features, which are the same for every pruned graph, are only
+# computed once.
+# If incremental is True, the levels saved with the pruned edges are processed
+# from the sparsest to the densest, and since each contains the edges of the
+# previous one, only the new edges are added to the running degrees, weight sums
+# and components (see graph_analytics.GraphGrowth).
+# If jobs is more than 1, the levels are instead processed independently in
+# that many worker processes, each saving its features as soon as it finishes.
+def genDonorFeatures(year, weightF, levels=None, bigraph=None, adjMat=None, newToOldIDs=None, incremental=False,
+        jobs=1):
     timing = Timer('Generating donor features for %d %s' % (year, weightF))
 
-    if not graphFiles:
-        graphFiles = getGraphFiles(year, weightF)
+    prunedGraphs = loadPrunedGraphs(year, weightF)
+    if not levels:
+        levels = getPruningLevels(year, weightF, prunedGraphs)
     if not bigraph:
         bigraph = graph_funcs.loadGraph('Data/Bipartite-Graphs/%d.graph' % year)
     if adjMat is None:
-        adjMat = pickler.load('Data/Unipartite-Matrix/%d.%s' % (year, weightF))
-        adjMat = adjMat.tocsc()
+        adjMat = weight_store.loadMatrix(year, weightF).tocsc()
     if newToOldIDs is None:
         newToOldIDs = pickler.load('Data/Unipartite-NodeMappings/%d.newToOld' % year)
     timing.markEvent('Loaded bigraph, adj matrix, and newToOld mapping')
 
-    for gf in graphFiles:
-        unigraph = graph_funcs.loadGraph('Data/Unipartite-Graphs/%s' % gf, snap.TUNGraph)
-        timing.markEvent('Loaded graph %s' % gf)
-
-        features = feature_extractor.generateFeatures(year, bigraph, unigraph, newToOldIDs, adjMat)
+    bipartiteFeatures = feature_extractor.extractBipartiteFeatures(bigraph,
+            aggregates=donor_aggregates.load(year, bigraph))
+    timing.markEvent('Extracted bipartite features')
+
+    if jobs > 1:
+        if incremental:
+            raise ValueError('Incremental donor features need the levels in order; use a single job')
+        sharedInputs.update(year=year, weightF=weightF, bigraph=bigraph, adjMat=adjMat,
+                newToOldIDs=newToOldIDs, prunedGraphs=prunedGraphs, bipartiteFeatures=bipartiteFeatures)
+        pool = multiprocessing.Pool(jobs)
+        results = []
+        for result in pool.imap_unordered(genLevelFeatures, levels):
+            timing.markEvent('Saved features for %s' % result[0])
+            results.append(result)
+        pool.close()
+        pool.join()
+        sharedInputs.clear()
+        printWorkerReport(results)
+        timing.finish()
+        return
+
+    nestedLevels = {}
+    if incremental and prunedGraphs is not None:
+        for kind, value in prunedGraphs.getLevels():
+            nestedLevels[pruned_graphs.getLevelName(year, weightF, kind, value)] = (kind, value)
+        levels = sorted([level for level in levels if level in nestedLevels],
+                key=lambda level: prunedGraphs.getNumEdges(*nestedLevels[level])) + \
+                [level for level in levels if level not in nestedLevels]
+        growth = graph_analytics.GraphGrowth(prunedGraphs.N)
+
+    for level in levels:
+        unigraph = loadUnigraph(year, weightF, level, prunedGraphs)
+        timing.markEvent('Loaded graph %s' % level)
+
+        if level in nestedLevels:
+            growth.update(*prunedGraphs.getEdges(*nestedLevels[level]))
+            features = feature_extractor.generateFeatures(year, bigraph, unigraph, newToOldIDs, adjMat,
+                    growth=growth, bipartiteFeatures=bipartiteFeatures)
+        else:
+            features = feature_extractor.generateFeatures(year, bigraph, unigraph, newToOldIDs, adjMat,
+                    bipartiteFeatures=bipartiteFeatures)
         timing.markEvent('Generated features')
 
-        pickler.save(features, 'Data/Features/%s.features' % gf)
+        feature_matrix.save(features, 'Data/Features/%s' % level)
         timing.markEvent('Saved features')
 
     timing.finish()
 
 # Saves the recipient features for all the pruned donor features with this weight
-# function.
-def genRecipFeatures(year, weightF, graphFiles=None, bigraph=None):
+# function. If jobs is more than 1, each level's recipients are split into
+# shards between that many worker processes (see
+# recip_feature_extractor.getRecipFeatures).
+def genRecipFeatures(year, weightF, levels=None, bigraph=None, jobs=1):
     timing = Timer('Generating recip features for %d %s' % (year, weightF))
 
-    if not graphFiles: graphFiles = getGraphFiles(year, weightF)
+    if not levels: levels = getPruningLevels(year, weightF)
     if not bigraph: bigraph = graph_funcs.loadGraph('Data/Bipartite-Graphs/%d.graph' % year)
 
     receiptsFromDonor, totalReceipts, totalDonations = \
-            recip_feature_extractor.getDonationAmounts(bigraph)
+            recip_feature_extractor.getDonationAmounts(bigraph, donor_aggregates.load(year, bigraph))
     partialFeatures, fullFeatures = \
             recip_feature_extractor.getCategoricalGraphFeatures(bigraph)
 
     timing.markEvent('Loaded bigraph, donor amounts, and categorical feature funcs')
 
-    for gf in graphFiles:
-        donorFeatures = pickler.load('Data/Features/%s.features' % gf)
-        timing.markEvent('Loaded donor features for graph %s' % gf)
+    for level in levels:
+        donorFeatures = feature_matrix.load('Data/Features/%s' % level)
+        timing.markEvent('Loaded donor features for graph %s' % level)
 
         recipFeatures = recip_feature_extractor.getRecipFeatures(
                 bigraph, donorFeatures, receiptsFromDonor, totalReceipts,
-                totalDonations, partialFeatures, fullFeatures)
+                totalDonations, partialFeatures, fullFeatures, jobs=jobs)
         timing.markEvent('Calculated recip features')
 
-        recip_feature_extractor.saveFeatures(bigraph, recipFeatures, 'Data/Recip-Features/%s' % gf)
+        recip_feature_extractor.saveFeatures(bigraph, recipFeatures, 'Data/Recip-Features/%s' % level)
         timing.markEvent('Saved recip features')
 
     timing.finish()
 
 # Returns the regression results for all the pruned recip features with this
 # weight function.
-def getResults(year, weightF, graphFiles=None):
+def getResults(year, weightF, levels=None):
     timing = Timer('Running regressions for %d %s' % (year, weightF))
 
     results = []
 
-    if not graphFiles: graphFiles = getGraphFiles(year, weightF)
+    if not levels: levels = getPruningLevels(year, weightF)
 
-    for gf in graphFiles:
-        X, Y = pickler.load('Data/Recip-Features/%s' % gf)
+    for level in levels:
+        X, Y, rnodeids = recip_features.load('Data/Recip-Features/%s' % level)
         rsquareds = cfscore_predictions.trainAndTestModels(year, weightF, X=X, Y=Y)
-        results.append([weightF, gf, rsquareds])
+        results.append([weightF, level, rsquareds])
 
     timing.finish()
 
     return results
 
-def runFullPipeline(year):
+def runFullPipeline(year, incremental=False, jobs=1):
     timing = Timer('Running pipeline for %d' % year)
 
     weightings = ('adamic', 'cosine', 'jaccard', 'jaccard2', 'weighted_adamic')
@@ -98,24 +214,28 @@ def runFullPipeline(year):
 
     for weightF in weightings:
 
-        graphFiles = getGraphFiles(year, weightF)
+        levels = getPruningLevels(year, weightF)
 
-        adjMat = pickler.load('Data/Unipartite-Matrix/%d.%s' % (year, weightF))
+        adjMat = weight_store.loadMatrix(year, weightF)
         timing.markEvent('Loaded everything for donor features')
-        genDonorFeatures(year, weightF, graphFiles=graphFiles, bigraph=bigraph,\
-                adjMat=adjMat, newToOldIDs=newToOldIDs)
+        genDonorFeatures(year, weightF, levels=levels, bigraph=bigraph,\
+                adjMat=adjMat, newToOldIDs=newToOldIDs, incremental=incremental, jobs=jobs)
         del adjMat # free the incredible amount of memory for the adjacency matrix
 
 
-        genRecipFeatures(year, weightF, graphFiles=graphFiles, bigraph=bigraph)
-        results = getResults(year, weightF, graphFiles=graphFiles)
+        genRecipFeatures(year, weightF, levels=levels, bigraph=bigraph, jobs=jobs)
+        results = getResults(year, weightF, levels=levels)
         pickler.save(results, 'Data/pruning_optimizations.%d.%s' % (year, weightF))
         timing.markEvent('Finished with %s' % weightF)
 
     timing.finish()
 
 if __name__ == '__main__':
-    for arg in sys.argv[1:]:
-        year = int(arg)
-        runFullPipeline(year)
+    # Pass --incremental to generate the donor features of the nested pruning
+    # levels incrementally, or --jobs <n> to generate them (and the recipient
+    # features of each level) in n worker processes (see genDonorFeatures and
+    # genRecipFeatures).
+    years, options = cli.parseArgs(sys.argv[1:], boolFlags=('incremental',))
+    for year in years:
+        runFullPipeline(year, options.get('incremental', False), int(options.get('jobs', 1)))
 
@@ -6,10 +6,11 @@
 # To call from the command line, run `python src/recip_feature_extractor <years>`
 # where years contains each year whose features you want to generate.
 
-import sys, snap
+import sys, os, snap, multiprocessing
 import numpy as np
+import scipy.sparse as sp
 from collections import defaultdict
-from util import pickler, graph_funcs
+from util import graph_funcs, donor_aggregates, feature_matrix, recip_features, cli
 from util.Timer import Timer
 from util.categorical import *
 
@@ -17,115 +18,268 @@ from util.categorical import *
 # Module functions #
 ################################################################################
 
-# Given a bipartite donor-recipient graph and a dictionary from cnodeids to
-# feature vectors, creates a dictionary from rnodeids to feature vectors.
+# The number of shards per worker process in the sharded mode of
+# getRecipFeatures and getBaselineFeatures, so that a worker that draws a slow
+# shard doesn't hold up the others.
+SHARDS_PER_JOB = 4
+
+# The cutoffs on a donor's total donations this cycle below which it counts as a
+# small contributor. The baseline has one small contributor share column per
+# cutoff (see getRecipReals).
+SMALL_DONOR_CUTOFFS = [200]
+
+# Inputs shared with the worker processes of the sharded mode. They are set
+# before the workers are forked, so the workers inherit them (read-only)
+# instead of receiving pickled copies.
+sharedInputs = {}
+
+# Given the number of donations of each recipient, splits the recipients into
+# at most numShards contiguous (start, end) ranges with about the same number
+# of donations each. Recipients aren't split, so a recipient with more donations
+# than a shard's share makes its shard larger than the others.
+def getRecipShards(counts, numShards):
+    cumCounts = np.concatenate(([0], np.cumsum(counts)))
+    targets = cumCounts[-1] * np.arange(1, numShards) / float(numShards)
+    bounds = np.unique(np.concatenate(([0], np.searchsorted(cumCounts, targets), [len(counts)])))
+    return zip(bounds[:-1].tolist(), bounds[1:].tolist())
+
+# Runs worker (a function of (shard index, start, end)) on every shard in jobs
+# worker processes, with sharedInputs set to inputs. Returns the workers'
+# results in shard order.
+def runShards(worker, shards, jobs, inputs):
+    sharedInputs.update(inputs)
+    pool = multiprocessing.Pool(jobs)
+    try:
+        results = pool.map(worker, [(index, start, end) for index, (start, end) in enumerate(shards)])
+    finally:
+        pool.close()
+        pool.join()
+        sharedInputs.clear()
+    return results
+
+# Given the (shard index, recipients, donations, pid, seconds, rows) results of
+# a sharded run, prints the time taken by each shard and how far the slowest
+# shard is from the average.
+def printShardReport(name, results):
+    print '%s shard report:' % name
+    print '  %6s %10s %10s %8s %10s' % ('shard', 'recips', 'donations', 'worker', 'seconds')
+    for index, numRecips, numDonations, pid, elapsed, rows in results:
+        print '  %6d %10d %10d %8d %10.2f' % (index, numRecips, numDonations, pid, elapsed)
+    times = np.array([result[4] for result in results])
+    print '  slowest shard: %.2fs, %.2fx the mean of %.2fs' % (times.max(), times.max() / max(times.mean(), 1e-9),
+            times.mean())
+
+# Given a bipartite donor-recipient graph and the donor features (a
+# util.feature_matrix.FeatureMatrix), creates a dictionary from rnodeids to
+# feature vectors. All the recipients are processed together (see
+# processDonorFeaturesForRecips), or, if jobs is more than 1, in shards of
+# recipients with about the same number of donations (see getRecipShards) split
+# between that many worker processes, which share the donor features.
 def getRecipFeatures(graph, donorFeatures, receiptsFromDonor, totalReceipts,
-        totalDonations, partialFeatures, fullFeatures, includeDonorFeatures=False):
+        totalDonations, partialFeatures, fullFeatures, includeDonorFeatures=False, jobs=1):
     timing = Timer('Getting recipient features')
-    recipFeatures = {}
-
-    for recipNode in graph_funcs.getRecipients(graph, cfs=True):
-        rnodeid = recipNode.GetId()
 
-        # Add a donor feature indicating what percent of this donor's donations
-        # went to this candidate.
-        for donor in receiptsFromDonor[rnodeid]:
-            pct = receiptsFromDonor[rnodeid][donor] / float(totalDonations[donor])
-            donorFeatures[donor].append(pct)
+    recipIDs = [recipNode.GetId() for recipNode in graph_funcs.getRecipients(graph, cfs=True)]
+    weights = getRecipDonationMatrix(recipIDs, receiptsFromDonor, donorFeatures.getIndex(), len(donorFeatures.ids))
+    donorTotals = np.array([totalDonations[donor] for donor in donorFeatures.ids.tolist()], dtype=np.float64)
+    timing.markEvent('Built recipient x donor donation matrix')
+
+    if jobs > 1:
+        shards = getRecipShards(np.diff(weights.indptr), jobs * SHARDS_PER_JOB)
+        results = runShards(getRecipShardFeatures, shards, jobs,
+                dict(weights=weights, donorX=donorFeatures.X, donorTotals=donorTotals))
+        printShardReport('Recipient features', results)
+        features = np.vstack([result[-1] for result in results])
+    else:
+        features = getDonorFeaturesForRecips(weights, donorFeatures.X, donorTotals, 0, len(recipIDs))
+    timing.markEvent('Computed quantiles and averages')
 
+    recipFeatures = {}
+    for row, rnodeid in enumerate(recipIDs):
         if includeDonorFeatures:
-            recipFeatures[rnodeid] = np.append(
-                getPartialNodeRecipSpecificFeatures(graph, rnodeid),
-                processDonorFeaturesForRecip(donorFeatures, receiptsFromDonor[rnodeid])
-            )
+            recipFeatures[rnodeid] = np.append(getPartialNodeRecipSpecificFeatures(graph, rnodeid), features[row])
         else:
-            recipFeatures[rnodeid] = \
-                processDonorFeaturesForRecip(donorFeatures, receiptsFromDonor[rnodeid])
-
-        # Remove the temporarily added feature for what percent of this donor's
-        # donations went to this candidate.
-        for donor in receiptsFromDonor[rnodeid]:
-            donorFeatures[donor].pop()
+            recipFeatures[rnodeid] = features[row]
 
     timing.finish()
     return recipFeatures
 
+# Given the recipient x donor donation matrix (see getRecipDonationMatrix), the
+# donor feature matrix and each donor's total donations, returns the feature
+# vectors (see processDonorFeaturesForRecips) of the recipients in rows
+# start:end.
+def getDonorFeaturesForRecips(weights, donorX, donorTotals, start, end):
+    lo, hi = weights.indptr[start], weights.indptr[end]
+    indices, data = weights.indices[lo:hi], weights.data[lo:hi]
+
+    # Gather the features of each recipient's donors in segment (CSR) order,
+    # plus a donor feature indicating what percent of this donor's donations
+    # went to this candidate.
+    pcts = data / donorTotals[indices]
+    featureVecs = np.column_stack((donorX[indices], pcts))
+
+    return processDonorFeaturesForRecips(featureVecs, data, weights.indptr[start:end + 1] - lo)
+
+# Computes the feature vectors of one shard of recipients from sharedInputs, in
+# a worker process. Returns the shard index, the number of recipients and
+# donations in the shard, the worker's pid, the time taken in seconds, and the
+# shard's rows of features.
+def getRecipShardFeatures(shard):
+    index, start, end = shard
+    weights = sharedInputs['weights']
+    timing = Timer('Recipient features shard %d' % index)
+    rows = getDonorFeaturesForRecips(weights, sharedInputs['donorX'], sharedInputs['donorTotals'], start, end)
+    elapsed = timing.elapsed()
+    timing.finish()
+    return index, end - start, int(weights.indptr[end] - weights.indptr[start]), os.getpid(), elapsed, rows
+
+# Given a list of rnodeids, the dictionary from rnodeid to the donations from
+# each cnodeid (see getDonationAmounts), and a dictionary from cnodeid to donor
+# (column) index, returns the recipient x donor CSR matrix of donation amounts.
+# Each row keeps the donors in the order of the recipient's dictionary, which
+# is the order the per-recipient computation has always seen them in.
+def getRecipDonationMatrix(recipIDs, receiptsFromDonor, donorIndex, numDonors):
+    indptr = np.zeros(len(recipIDs) + 1, dtype=np.int64)
+    indices = []
+    amounts = []
+    for row, rnodeid in enumerate(recipIDs):
+        receipts = receiptsFromDonor[rnodeid]
+        indices.extend([donorIndex[donor] for donor in receipts])
+        amounts.extend(receipts.values())
+        indptr[row + 1] = len(indices)
+    return sp.csr_matrix((np.array(amounts, dtype=np.float64), np.array(indices, dtype=np.int64), indptr),
+            shape=(len(recipIDs), numDonors))
+
 # Creates a dictionary from rnodeids to feature vectors, where each feature vector
 # has the node-specific features to be used in the baseline. To improve the quality
 # of the baseline, this is restricted to full nodes for which all node specific
 # features can be calculated.
-def getBaselineFeatures(graph, receiptsFromDonor, totalReceipts, totalDonations, partialFeatures, fullFeatures):
-    features = {}
-
-
-    for node in graph_funcs.getRecipients(graph, cfs=True, full=True):
-        rnodeid = node.GetId()
-        features[rnodeid] = np.append(
-            getPartialNodeRecipFeatures(graph, rnodeid, receiptsFromDonor, totalReceipts, totalDonations, partialFeatures),
-            getFullNodeRecipFeatures(graph, rnodeid, fullFeatures)
-        )
-
-    return features
+#
+# There is one small contributor share column per cutoff in smallDonorCutoffs.
+# If jobs is more than 1, the recipients are split into shards with about the
+# same number of donations (see getRecipShards) between that many worker
+# processes.
+def getBaselineFeatures(graph, receiptsFromDonor, totalReceipts, totalDonations, partialFeatures, fullFeatures,
+        jobs=1, smallDonorCutoffs=SMALL_DONOR_CUTOFFS):
+    recipIDs = [node.GetId() for node in graph_funcs.getRecipients(graph, cfs=True, full=True)]
+
+    if jobs > 1:
+        shards = getRecipShards([len(receiptsFromDonor[rnodeid]) for rnodeid in recipIDs], jobs * SHARDS_PER_JOB)
+        results = runShards(getBaselineShardFeatures, shards, jobs,
+                dict(graph=graph, recipIDs=recipIDs, receiptsFromDonor=receiptsFromDonor,
+                    totalReceipts=totalReceipts, totalDonations=totalDonations,
+                    partialFeatures=partialFeatures, fullFeatures=fullFeatures,
+                    smallDonorCutoffs=smallDonorCutoffs))
+        printShardReport('Baseline features', results)
+        rows = np.vstack([result[-1] for result in results])
+    else:
+        rows = getBaselineFeaturesForRecips(graph, recipIDs, receiptsFromDonor, totalReceipts, totalDonations,
+                partialFeatures, fullFeatures, smallDonorCutoffs)
+
+    return dict(zip(recipIDs, rows))
+
+# Returns the len(recipIDs) x F matrix of the baseline feature vectors of the
+# given recipients: the partial node features (see getPartialNodeRecipFeatures)
+# followed by the full node features. The dummy variables and the real-valued
+# features of all the recipients are built together (see
+# util.categorical.getOneHotBlock and getRecipReals).
+def getBaselineFeaturesForRecips(graph, recipIDs, receiptsFromDonor, totalReceipts, totalDonations,
+        partialFeatures, fullFeatures, smallDonorCutoffs=SMALL_DONOR_CUTOFFS):
+    reals = getRecipReals(graph, recipIDs, receiptsFromDonor, totalReceipts, totalDonations, smallDonorCutoffs)
+    return np.hstack((getOneHotBlock(partialFeatures.values(), recipIDs), reals,
+            getOneHotBlock(fullFeatures.values(), recipIDs)))
+
+# Computes the baseline feature vectors of one shard of recipients from
+# sharedInputs, in a worker process. Returns the same results as
+# getRecipShardFeatures.
+def getBaselineShardFeatures(shard):
+    index, start, end = shard
+    timing = Timer('Baseline features shard %d' % index)
+    recipIDs = sharedInputs['recipIDs'][start:end]
+    receiptsFromDonor = sharedInputs['receiptsFromDonor']
+    rows = getBaselineFeaturesForRecips(sharedInputs['graph'], recipIDs, receiptsFromDonor,
+            sharedInputs['totalReceipts'], sharedInputs['totalDonations'], sharedInputs['partialFeatures'],
+            sharedInputs['fullFeatures'], sharedInputs['smallDonorCutoffs'])
+    elapsed = timing.elapsed()
+    timing.finish()
+    numDonations = sum(len(receiptsFromDonor[rnodeid]) for rnodeid in recipIDs)
+    return index, end - start, numDonations, os.getpid(), elapsed, rows
 
 # Given a bipartite graph and a dictionary from rnodeids to feature vectors,
-# constructs and returns the X feature matrix and Y vector. Can also apply a
-# transformation function to Y (y_fun) or transformation functions to various
-# columns of X (represented in x_funs as a dictionary from column indices to
-# functions).
-def featureDictToVecs(graph, featureDict, y_fun=None, x_funs=None):
-    X = np.asarray([features for rnodeid, features in featureDict.iteritems()])
-    Y = np.asarray([graph.GetFltAttrDatN(rnodeid, 'cfs') for rnodeid in featureDict])
+# constructs and returns the X feature matrix (with the given dtype), the Y
+# vector, and the array of the rnodeid of each row. X is allocated up front and
+# filled in place, one row per rnodeid, and Y is read for the same array of
+# rnodeids. Can also apply a transformation function to Y (y_fun) or
+# transformation functions to various columns of X (represented in x_funs as a
+# dictionary from column indices to functions).
+def assembleFeatures(graph, featureDict, y_fun=None, x_funs=None, dtype=np.float64):
+    rnodeids = np.fromiter(featureDict, dtype=np.int64, count=len(featureDict))
+    numFeatures = len(featureDict[rnodeids[0]]) if len(rnodeids) else 0
+
+    X = np.empty((len(rnodeids), numFeatures), dtype=dtype)
+    for row, rnodeid in enumerate(rnodeids.tolist()):
+        X[row] = featureDict[rnodeid]
+    Y = np.fromiter((graph.GetFltAttrDatN(rnodeid, 'cfs') for rnodeid in rnodeids.tolist()),
+            dtype=np.float64, count=len(rnodeids))
+
     if y_fun:
         Y = y_fun(Y)
     if x_funs:
         for col, fun in x_funs.iteritems():
             X[:,col] = fun(X[:,col])
+    return X, Y, rnodeids
+
+# The same as assembleFeatures, returning only the X feature matrix and Y vector.
+def featureDictToVecs(graph, featureDict, y_fun=None, x_funs=None, dtype=np.float64):
+    X, Y, rnodeids = assembleFeatures(graph, featureDict, y_fun=y_fun, x_funs=x_funs, dtype=dtype)
     return X, Y
 
 # Given a graph, a dictionary from rnodeids to feature vectors, and optionally
 # transformation functions to run on the Y vector and the columns of the X
-# feature matrix (see featureDictToVecs), saves the X feature matrix and Y vector
-# as a tuple to the designated file.
-def saveFeatures(graph, featureDict, filename, y_fun=None, x_funs=None):
-    X, Y = featureDictToVecs(graph, featureDict, y_fun=y_fun, x_funs=x_funs)
-    pickler.save((X, Y), filename)
+# feature matrix (see assembleFeatures), saves the X feature matrix, Y vector
+# and row rnodeids to the designated file (see util.recip_features).
+def saveFeatures(graph, featureDict, filename, y_fun=None, x_funs=None, dtype=np.float64):
+    X, Y, rnodeids = assembleFeatures(graph, featureDict, y_fun=y_fun, x_funs=x_funs, dtype=dtype)
+    recip_features.save(filename, X, Y, rnodeids)
 
 # Given a bipartite donor-recipient graph, creates one dictionary from int to
 # dictionaries from ints to ints, and two dictionaries from ints to ints. The
 # first shows, for a given candidate, the total donations from a given donor.
 # The second and third show, for a given candidate or donor, how much they
-# received or donated in total.
-def getDonationAmounts(graph):
+# received or donated in total. They are built from the graph's donor aggregates
+# (see util.donor_aggregates), which are computed from the graph if not passed in.
+def getDonationAmounts(graph, aggregates=None):
     timing = Timer('Getting candidate, donor, and cand-donor donation amounts')
-    # A dictionary from rnodeids to dictionaries from cnodeids to floats indicating
+    if aggregates is None:
+        aggregates = donor_aggregates.fromGraph(graph)
+
+    # A dictionary from rnodeids to dictionaries from cnodeids to ints indicating
     # the total donations from that donor to that candidate
-    receiptsFromDonor = defaultdict(lambda: defaultdict(int))
+    receiptsFromDonor = defaultdict(dict)
+    byRecip = aggregates.getMatrix().tocsc()
+    donors = aggregates.donors.tolist()
+    indptr = byRecip.indptr.tolist()
+    indices = byRecip.indices.tolist()
+    amounts = byRecip.data.tolist()
+    for col, recip in enumerate(aggregates.recips.tolist()):
+        start, end = indptr[col], indptr[col + 1]
+        receiptsFromDonor[recip] = dict(zip([donors[row] for row in indices[start:end]], amounts[start:end]))
 
     # A dictionary from rnodeids to ints indicating the total amount donated to
     # that candidate.
-    totalReceipts = defaultdict(int)
+    totalReceipts = defaultdict(int, zip(aggregates.recips.tolist(), aggregates.getTotalReceipts().tolist()))
 
     # A dictionary from cnodeids to ints indicating the total amount donated by
     # that donor.
-    totalDonations = defaultdict(int)
-
-    # For each donation, note it in the relevant dictionaries
-    for edge in graph.Edges():
-        donor = edge.GetSrcNId()
-        recip = edge.GetDstNId()
-        amount = graph.GetIntAttrDatE(edge.GetId(), 'amount')
-
-        receiptsFromDonor[recip][donor] += amount
-        totalReceipts[recip] += amount
-        totalDonations[donor] += amount
+    totalDonations = defaultdict(int, zip(donors, aggregates.getTotalAmounts().tolist()))
 
     timing.finish()
     return receiptsFromDonor, totalReceipts, totalDonations
 
-# Given the donor features and the weights this recipient should put on the donors
-# (proportional to the percent of the recipient's donations coming from that donor),
-# computes the portion of the recipient's feature vector dependent on the donor
-# features.
+# Given the M x N matrix of the feature vectors of a recipient's M donors and the
+# weights this recipient should put on the donors (proportional to the percent of
+# the recipient's donations coming from that donor), computes the portion of the
+# recipient's feature vector dependent on the donor features.
 #
 # Currently calculates min, max, mean, median, 25th percentile and 75 percentile.
 # First, the min, 25th percentile, median, 75th percentile, and max for each feature
@@ -133,32 +287,85 @@ def getDonationAmounts(graph):
 # the weighted averages of all the donor features are added to the end of the feature
 # vector. All statistics for the donor features are weighted by that donor's donations
 # to this candidate.
-def processDonorFeaturesForRecip(donorFeatures, weightsForDonors):
-    # Let N be the number of donor features and M be the number of donors in
-    # weightsForDonors
-
-    # Should be a 5N X 1 vector
-    features = np.zeros(0)
-
-    # M x 1 vector
-    weights = [weightsForDonors[donor] for donor in weightsForDonors]
-
-    # M X N matrix
-    unnormalizedFeatureVecs = np.array([donorFeatures[donor] for donor in weightsForDonors])
-    squares = []
-
-    # Iterate over the columns (distribution for a feature) calculating quantiles and squares.
-    # Runs N times
-    for col in range(len(unnormalizedFeatureVecs[0])):
-        # 5 X 1 vector
-        quantiles = weighted_quantile(unnormalizedFeatureVecs[:,col], [0.0, 0.25, 0.5, 0.75, 1.0], sample_weight=weights)
-        features = np.append(features, quantiles)
-
-    # N x 1 vector
-    averages = np.average(unnormalizedFeatureVecs, weights=weights, axis=0)
-
-    # 6N X 1 vector
-    return np.append(features, averages)
+def processDonorFeaturesForRecip(unnormalizedFeatureVecs, weights):
+    return processDonorFeaturesForRecips(unnormalizedFeatureVecs, weights, [0, len(weights)])[0]
+
+# The same for many recipients at once: unnormalizedFeatureVecs and weights hold
+# the donor feature vectors and weights of every recipient's donors, one
+# recipient after the other, with recipient i's donors at positions
+# indptr[i]:indptr[i + 1] (as in a CSR matrix). Returns the R x 6N matrix of
+# recipient feature vectors. The quantiles of every feature are computed for all
+# the recipients with one segment-wise sort and interpolation (see
+# segmentedWeightedQuantiles), and the weighted averages with one sparse product.
+def processDonorFeaturesForRecips(unnormalizedFeatureVecs, weights, indptr):
+    # Let N be the number of donor features, R the number of recipients and M
+    # the total number of donations
+    unnormalizedFeatureVecs = np.asarray(unnormalizedFeatureVecs, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    indptr = np.asarray(indptr, dtype=np.int64)
+    numRecips, numFeatures = len(indptr) - 1, unnormalizedFeatureVecs.shape[1]
+
+    # R x N x 5 array, grouped by the donor feature the quantiles represent
+    quantiles = np.empty((numRecips, numFeatures, 5))
+    for col in range(numFeatures):
+        quantiles[:, col, :] = segmentedWeightedQuantiles(unnormalizedFeatureVecs[:, col],
+                [0.0, 0.25, 0.5, 0.75, 1.0], weights, indptr)
+
+    # R x M matrix of the weights of each recipient's donors, so that the
+    # weighted sums of the features are a single product. R x N averages
+    segmentWeights = sp.csr_matrix((weights, np.arange(len(weights)), indptr), shape=(numRecips, len(weights)))
+    totals = np.asarray(segmentWeights.sum(axis=1)).ravel()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        averages = segmentWeights.dot(unnormalizedFeatureVecs) / totals[:, np.newaxis]
+
+    # R x 6N matrix
+    return np.hstack((quantiles.reshape(numRecips, 5 * numFeatures), averages))
+
+# Computes the weighted quantiles (as weighted_quantile does) of many segments of
+# values at once: segment i holds values[indptr[i]:indptr[i + 1]] with weights
+# sample_weight[indptr[i]:indptr[i + 1]]. Returns the (number of segments) x
+# len(quantiles) array of quantiles. The values are sorted within their segments
+# with one (stable) lexsort, and np.interp's interpolation is reproduced for all
+# the segments at once, so the results match weighted_quantile's for each
+# segment (exactly, for integer weights).
+def segmentedWeightedQuantiles(values, quantiles, sample_weight, indptr):
+    values = np.asarray(values, dtype=np.float64)
+    sample_weight = np.asarray(sample_weight, dtype=np.float64)
+    indptr = np.asarray(indptr, dtype=np.int64)
+    numSegments = len(indptr) - 1
+    lengths = np.diff(indptr)
+    segments = np.repeat(np.arange(numSegments), lengths)
+
+    sorter = np.lexsort((values, segments))
+    values = values[sorter]
+    sample_weight = sample_weight[sorter]
+
+    # Cumulative weights restarting at each segment, normalized by its total
+    cumWeights = np.cumsum(sample_weight)
+    segmentStarts = np.concatenate(([0.0], cumWeights))[indptr[:-1]]
+    totals = np.concatenate(([0.0], cumWeights))[indptr[1:]] - segmentStarts
+    weighted_quantiles = cumWeights - segmentStarts[segments] - 0.5 * sample_weight
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weighted_quantiles /= totals[segments]
+
+    results = np.zeros((numSegments, len(quantiles)))
+    nonempty = lengths > 0
+    first, last = indptr[:-1][nonempty], indptr[1:][nonempty] - 1
+    for i, q in enumerate(quantiles):
+        # Index of the last point at or below q in each segment (first - 1 if none)
+        j = first + np.bincount(segments, weights=(weighted_quantiles <= q), minlength=numSegments)[nonempty] \
+                .astype(np.int64) - 1
+        below = j < first
+        atEnd = j == last
+        jc = np.clip(j, first, last)
+        jn = np.minimum(jc + 1, last)
+        exact = weighted_quantiles[jc] == q
+        with np.errstate(invalid='ignore', divide='ignore'):
+            slope = (values[jn] - values[jc]) / (weighted_quantiles[jn] - weighted_quantiles[jc])
+            interpolated = slope * (q - weighted_quantiles[jc]) + values[jc]
+        results[nonempty, i] = np.where(below, values[first], np.where(atEnd | exact, values[jc], interpolated))
+
+    return results
 
 # This calculates weighted quantiles.
 # Modified from https://stackoverflow.com/questions/21844024/weighted-percentile-using-numpy.
@@ -183,7 +390,8 @@ def weighted_quantile(values, quantiles, sample_weight=None, values_sorted=False
     assert np.all(quantiles >= 0) and np.all(quantiles <= 1), 'quantiles should be in [0, 1]'
 
     if not values_sorted:
-        sorter = np.argsort(values)
+        # A stable sort, so that tied values keep the order of the input
+        sorter = np.argsort(values, kind='mergesort')
         values = values[sorter]
         sample_weight = sample_weight[sorter]
 
@@ -203,33 +411,46 @@ def weighted_quantile(values, quantiles, sample_weight=None, values_sorted=False
 # Creates a feature vector of the node features available only to full recipient
 # nodes.
 def getFullNodeRecipFeatures(graph, rnodeid, fullFeatures):
-    node = graph.GetNI(rnodeid)
-    return reduce(np.append, [f(node) for f in fullFeatures.values()])
+    return getOneHotBlock(fullFeatures.values(), [rnodeid])[0]
 
 # Creates a feature vector of the node features available even to partial recipient
 # nodes.
 def getPartialNodeRecipFeatures(graph, rnodeid, receiptsFromDonor, totalReceipts, totalDonations, partialFeatures):
-    node = graph.GetNI(rnodeid)
-
-    # Sum of contributions to this recipient from contributors who donated less than $200 to any candidate this cycle:
-    donationsFromSmallContributors = sum(receiptsFromDonor[rnodeid][cnodeid] \
-        for cnodeid in receiptsFromDonor[rnodeid] if (totalDonations[cnodeid] < 200))
-    # Feature: percent of donations from low budget contributors
-    percentDonationsFromSmallContributors = donationsFromSmallContributors / float(totalReceipts[rnodeid])
-
-    dummies = reduce(np.append, [f(node) for f in partialFeatures.values()])
-    reals = np.asarray([
-        node.GetInDeg(),
-        np.log(totalReceipts[rnodeid]),
-        percentDonationsFromSmallContributors,
-    ])
-
-    return np.append(dummies, reals)
-
-# Returns two ditionaries containing all the categorical feature functions. The
-# first dict has the feature functions for the features available even for partial
-# nodes, while the second has the feature functions for the features only
-# available for full nodes
+    dummies = getOneHotBlock(partialFeatures.values(), [rnodeid])[0]
+    return np.append(dummies, getRecipReals(graph, [rnodeid], receiptsFromDonor, totalReceipts, totalDonations)[0])
+
+# Returns the len(recipIDs) x (2 + len(smallDonorCutoffs)) matrix of the
+# real-valued partial node features of the given recipients: the in-degree, the
+# log of the total receipts, and for each cutoff the percent of the receipts
+# from small contributors (who donated less than the cutoff to all candidates
+# this cycle). The shares for all the cutoffs are a single sparse product of the
+# recipient x donation matrix of amounts with the donation x cutoff matrix of
+# small contributor indicators.
+def getRecipReals(graph, recipIDs, receiptsFromDonor, totalReceipts, totalDonations,
+        smallDonorCutoffs=SMALL_DONOR_CUTOFFS):
+    counts = np.array([len(receiptsFromDonor[rnodeid]) for rnodeid in recipIDs], dtype=np.int64)
+    indptr = np.concatenate(([0], np.cumsum(counts)))
+    numDonations = int(indptr[-1])
+    amounts = np.fromiter((amount for rnodeid in recipIDs for amount in receiptsFromDonor[rnodeid].itervalues()),
+            dtype=np.float64, count=numDonations)
+    donorTotals = np.fromiter((totalDonations[cnodeid] for rnodeid in recipIDs for cnodeid in receiptsFromDonor[rnodeid]),
+            dtype=np.float64, count=numDonations)
+
+    byRecip = sp.csr_matrix((amounts, np.arange(numDonations), indptr), shape=(len(recipIDs), numDonations))
+    small = (donorTotals[:, np.newaxis] < np.asarray(smallDonorCutoffs, dtype=np.float64)).astype(np.float64)
+    receipts = np.array([totalReceipts[rnodeid] for rnodeid in recipIDs], dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        smallShares = byRecip.dot(small) / receipts[:, np.newaxis]
+        logReceipts = np.log(receipts)
+
+    inDegrees = np.array([graph.GetNI(rnodeid).GetInDeg() for rnodeid in recipIDs], dtype=np.float64)
+    return np.column_stack((inDegrees, logReceipts, smallShares))
+
+# Returns two ditionaries containing all the categorical features (see
+# util.categorical.CategoricalFeature), with the category of every recipient
+# extracted up front. The first dict has the features available even for
+# partial nodes, while the second has the features only available for full
+# nodes
 def getCategoricalGraphFeatures(graph, full=False):
     partialFeatures = {}
     fullFeatures = {}
@@ -253,26 +474,35 @@ if __name__ == '__main__':
     #weightings = ('jaccard', 'jaccard2', 'affinity', 'cosine', 'adamic', 'weighted_adamic')
     #weightings = ('adamic', 'weighted_adamic')
     weightings = ('jaccard2',)
-    for year in sys.argv[1:]:
-        year = int(year)
+    # Pass --jobs <n> to compute the features of shards of recipients in n
+    # worker processes, and --small-donor-cutoffs <a,b,...> to change the
+    # baseline's small contributor cutoffs (see SMALL_DONOR_CUTOFFS), and
+    # --dtype float32 to save the feature matrices as single precision.
+    years, options = cli.parseArgs(sys.argv[1:])
+    jobs = int(options.get('jobs', 1))
+    smallDonorCutoffs = cli.parseList(options.get('small-donor-cutoffs'), float, SMALL_DONOR_CUTOFFS)
+    dtype = np.dtype(options.get('dtype', 'float64'))
+    for year in years:
         timing = Timer('Generating features for %d' % year)
         graph = graph_funcs.loadGraph('Data/Bipartite-Graphs/%d.graph' % year)
-        receiptsFromDonor, totalReceipts, totalDonations = getDonationAmounts(graph)
+        receiptsFromDonor, totalReceipts, totalDonations = \
+                getDonationAmounts(graph, donor_aggregates.load(year, graph))
         partialFeatures, fullFeatures = getCategoricalGraphFeatures(graph)
 
         baselineFeatures = \
-            getBaselineFeatures(graph, receiptsFromDonor, totalReceipts, totalDonations, partialFeatures, fullFeatures)
-        saveFeatures(graph, baselineFeatures, 'Data/Recip-Features/%d.baseline' % year)
+            getBaselineFeatures(graph, receiptsFromDonor, totalReceipts, totalDonations, partialFeatures, fullFeatures,
+                    jobs=jobs, smallDonorCutoffs=smallDonorCutoffs)
+        saveFeatures(graph, baselineFeatures, 'Data/Recip-Features/%d.baseline' % year, dtype=dtype)
         timing.markEvent('Generated baseline features')
 
         for weighting in weightings:
-            donorFeatures = pickler.load('Data/Features/%d%s.features' \
+            donorFeatures = feature_matrix.load('Data/Features/%d%s' \
                     % (year, weighting))
             recipFeatures = getRecipFeatures(
                     graph, donorFeatures, receiptsFromDonor, totalReceipts,
-                    totalDonations, partialFeatures, fullFeatures)
+                    totalDonations, partialFeatures, fullFeatures, jobs=jobs)
             saveFeatures(graph, recipFeatures, 'Data/Recip-Features/%d.%s' \
-                    % (year, weighting))
+                    % (year, weighting), dtype=dtype)
             timing.markEvent('Calculated main recipient features for %s' \
                     % weighting)
 
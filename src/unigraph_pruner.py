@@ -1,95 +1,245 @@
-import snap, sys
+import snap, sys, os, tempfile, multiprocessing
 import numpy as np
-from util import pickler, graph_funcs
+from util import graph_funcs, weight_store, pruned_graphs, cli, quantile_sketch
+from util.pruned_graphs import getNumEdgesAboveThreshold
 from util.Timer import Timer
 
 ################################################################################
 # Module functions #
 ################################################################################
 
-# Given a file for a sparse weighted adjacency matrix, returns a list of node
-# index pairs and their adjacency weighting.
-# The return value is a list of tuples where the first two elements are the
-# smaller and larger node id and the third element is the weighting. Also
-# returns the number of nodes to be inserted into the new graph.
-def getSortedMatrixVals(filename):
-    timing = Timer('Gettin sorted matrix vals')
-    adjMat = pickler.load(filename)
-    timing.markEvent('Loaded adjacency matrix')
+# Given a sparse weighted adjacency matrix in CSR form, returns its edges sorted
+# by decreasing weight as a tuple of three arrays: the smaller node ids, the
+# larger node ids, and the weights. Only the upper triangle is read, so each
+# undirected edge appears once. If maxEdges is given, only that many of the
+# highest weighted edges are kept (selected with argpartition before sorting).
+def getSortedEdges(adjMat, maxEdges=None):
     N = adjMat.shape[0]
-    xIndices, yIndices = adjMat.nonzero()
-    timing.markEvent('Loaded nonzero indices')
-    data = adjMat[xIndices, yIndices]
-    timing.markEvent('Loaded nonzero vals')
-    flat = np.ravel(data)
-    timing.markEvent('Flattened data')
-
-    vals = zip(xIndices, yIndices, flat)
-    timing.markEvent('Zipped values')
-    vals.sort(key=lambda v: v[2], reverse=True)
-    timing.markEvent('Sorted values')
-    print vals[0][2] > vals[1][2]
-    print vals[0][2], vals[1][2]
-    raise ValueError("LOL")
-    return vals, N
+    indptr = np.asarray(adjMat.indptr)
+    cols = np.asarray(adjMat.indices)
+    weights = np.asarray(adjMat.data)
+    rows = np.repeat(np.arange(N, dtype=cols.dtype), np.diff(indptr))
+
+    upper = cols > rows
+    if not upper.all():
+        rows, cols, weights = rows[upper], cols[upper], weights[upper]
+
+    if maxEdges is not None and maxEdges < len(weights):
+        order = np.argpartition(-weights, maxEdges - 1)[:maxEdges]
+        order = order[np.argsort(-weights[order], kind='mergesort')]
+    else:
+        order = np.argsort(-weights, kind='mergesort')
+
+    return rows[order], cols[order], weights[order]
+
+# Given a year and a weighting, loads the (upper-triangular) weight matrix and
+# returns its edges sorted by decreasing weight (see getSortedEdges) and the
+# number of nodes to be inserted into the new graph. The structure shared by
+# the weight matrices of this year can be passed in if it is already loaded.
+def getSortedMatrixVals(year, weighting, maxEdges=None, structure=None):
+    timing = Timer('Getting sorted matrix vals')
+    adjMat = weight_store.loadMatrix(year, weighting, symmetric=False, structure=structure)
+    timing.markEvent('Loaded adjacency matrix')
+
+    sortedVals = getSortedEdges(adjMat, maxEdges)
+    timing.finish()
+    return sortedVals, adjMat.shape[0]
 
 # Given the vals from getSortedMatrixVals, the number of nodes, and a percent
 # threshold, creates a graph whose edges are those with the (percent)% highest
 # weights.
 def pruneGraphByPercent(sortedVals, N, percent):
-    numEdges = int(len(sortedVals) * percent)
-    graph = snap.TUNGraph.New(N, numEdges)
-
-    for i in range(N):
-        graph.AddNode()
-
-    for n1, n2, weight in sortedVals[:numEdges]:
-        graph.AddEdge(int(n1), int(n2))
-
-    return graph
+    rows, cols, weights = sortedVals
+    numEdges = int(len(weights) * percent)
+    return graph_funcs.graphFromEdgeArrays(rows[:numEdges], cols[:numEdges], N)
 
 # Given the vals from getSortedMatrixVals, the number of nodes, and a weight
 # threshold that must be met, creates a graph whose edges are those with weights
 # at least meeting the threshold.
 def pruneGraphByThreshold(sortedVals, N, threshold):
-    graph = snap.TUNGraph.New(N, N)
+    rows, cols, weights = sortedVals
+    numEdges = getNumEdgesAboveThreshold(weights, threshold)
+    return graph_funcs.graphFromEdgeArrays(rows[:numEdges], cols[:numEdges], N)
+
+# Given the vals from getSortedMatrixVals and lists of percents and thresholds,
+# returns the sorted list of cut points as tuples of the number of edges kept,
+# the kind of cut ('percent' or 'threshold'), and the percent or threshold.
+def getCutPoints(sortedVals, percents=None, thresholds=None):
+    weights = sortedVals[2]
+    cuts = [(int(len(weights) * p), 'percent', p) for p in percents or []]
+    cuts += [(getNumEdgesAboveThreshold(weights, t), 'threshold', t) for t in thresholds or []]
+    cuts.sort()
+    return cuts
+
+# Generator over the pruned graphs for every percent and threshold, which are
+# all prefixes of the same sorted edge order. The sorted edges are walked once:
+# at each cut point (in increasing number of edges) only the edges since the
+# previous cut are appended to a shared edge list file, from which the graph is
+# loaded in bulk. Yields tuples of the kind of cut, the percent or threshold,
+# and the graph.
+def pruneGraphsNested(sortedVals, N, percents=None, thresholds=None):
+    rows, cols, weights = sortedVals
+    fd, filename = tempfile.mkstemp(suffix='.edges')
+    written = 0
+
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for numEdges, kind, value in getCutPoints(sortedVals, percents, thresholds):
+                graph_funcs.writeEdgeList(f, rows[written:numEdges], cols[written:numEdges])
+                f.flush()
+                written = numEdges
+                yield kind, value, graph_funcs.loadEdgeListGraph(filename, N)
+    finally:
+        os.remove(filename)
+
+# Given a year, a weighting, and a list of thresholds that are either weights or
+# quantiles of the weights written as 'q<quantile>' (e.g. 'q0.99'), returns the
+# list of weight thresholds. Quantiles are resolved with the weighting's saved
+# quantile sketch (see util.quantile_sketch), without sorting the edges.
+def resolveThresholds(year, weighting, thresholds):
+    resolved = []
+    for t in thresholds:
+        if isinstance(t, basestring) and t.startswith('q'):
+            summary = quantile_sketch.loadSummary(year, weighting)
+            resolved.append(float(quantile_sketch.getQuantiles(summary, [float(t[1:])])[0]))
+        else:
+            resolved.append(float(t))
+    return resolved
+
+# Given the two endpoint arrays of a set of undirected edges (each edge possibly
+# appearing in both directions), returns (smaller ids, larger ids) arrays with
+# every edge exactly once.
+def getUniqueUndirectedEdges(rows, cols, N):
+    low = np.minimum(rows, cols).astype(np.int64)
+    high = np.maximum(rows, cols).astype(np.int64)
+    edges = np.unique(low * N + high)
+    return edges // N, edges % N
+
+# Given a symmetric weighted adjacency matrix in CSR form and k, returns the
+# (smaller ids, larger ids) arrays of the edges that are among the k highest
+# weighted edges of at least one of their endpoints.
+def getTopKEdges(adjMat, k):
+    N = adjMat.shape[0]
+    indptr = np.asarray(adjMat.indptr)
+    cols = np.asarray(adjMat.indices)
+    weights = np.asarray(adjMat.data)
+    rows = np.repeat(np.arange(N), np.diff(indptr))
+
+    # Sort the entries by row and then by decreasing weight, and rank each
+    # entry within its row
+    order = np.lexsort((-weights, rows))
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order)) - indptr[rows[order]]
 
-    for i in range(N):
-        graph.AddNode()
+    keep = ranks < k
+    return getUniqueUndirectedEdges(rows[keep], cols[keep], N)
 
-    for n1, n2, weight in sortedVals:
-        if weight < threshold:
-            break
-        graph.AddEdge(int(n1), int(n2))
+# Given a symmetric weighted adjacency matrix in CSR form and a significance
+# level alpha, returns the (smaller ids, larger ids) arrays of the disparity
+# filter backbone (Serrano et al., 2009): an edge is kept if, for at least one
+# of its endpoints with degree k and strength s, the probability
+# (1 - w / s) ^ (k - 1) of seeing an edge that heavy under a uniform split of s
+# across k edges is below alpha. Edges of degree 1 nodes are only kept if they
+# are significant for the other endpoint.
+def getDisparityEdges(adjMat, alpha):
+    N = adjMat.shape[0]
+    indptr = np.asarray(adjMat.indptr)
+    cols = np.asarray(adjMat.indices)
+    weights = np.asarray(adjMat.data, dtype=np.float64)
+    degrees = np.diff(indptr)
+    rows = np.repeat(np.arange(N), degrees)
+    strengths = np.bincount(rows, weights=weights, minlength=N)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pvalues = (1.0 - weights / strengths[rows]) ** (degrees[rows] - 1)
+
+    keep = pvalues < alpha
+    return getUniqueUndirectedEdges(rows[keep], cols[keep], N)
+
+# Dictionary from backbone pruning kind to the function extracting its edges
+# from the symmetric weight matrix for a given parameter.
+backboneFunctions = {
+    'topk': getTopKEdges,
+    'disparity': getDisparityEdges,
+}
+
+# Given a year, a weighting function, and a dictionary from backbone kind (see
+# backboneFunctions) to the list of parameters to generate graphs for, generates
+# the backbone graphs and saves them to Data/Unipartite-Graphs with the same
+# filename scheme as the percent and threshold graphs.
+def processBackbones(year, weighting, backbones, structure=None):
+    timing = Timer('Extracting backbones for year %d and weight %s' % (year, weighting))
+    adjMat = weight_store.loadMatrix(year, weighting, structure=structure)
+    N = adjMat.shape[0]
+    timing.markEvent('Loaded adjacency matrix')
 
-    return graph
+    for kind, values in sorted(backbones.iteritems()):
+        for value in values:
+            rows, cols = backboneFunctions[kind](adjMat, value)
+            outfile = 'Data/Unipartite-Graphs/%s.graph' \
+                    % pruned_graphs.getLevelName(year, weighting, kind, value)
+            graph_funcs.saveGraph(graph_funcs.graphFromEdgeArrays(rows, cols, N), outfile)
+            timing.markEvent('Finished for %s %f (%d edges)' % (kind, value, len(rows)))
+
+    timing.finish()
 
 # Given a year, a weighting function, and lists of percentages and thresholds
-# to generate graphs for, generates graphs and saves them to
-# Data/Unipartite-Graphs with a filename indicating the parameters.
-def processYearAndWeight(year, weighting, percents=None, thresholds=None):
+# to generate graphs for, saves the weight-sorted edges and the cut offsets of
+# every percent and threshold to Data/Unipartite-Edges (see util.pruned_graphs),
+# from which any pruned graph can be materialized on demand. If saveGraphs is
+# True, also generates the graphs and saves them to Data/Unipartite-Graphs with
+# a filename indicating the parameters. Backbone graphs are also generated for
+# the backbones dictionary (see processBackbones), if given. Returns the time
+# taken in seconds.
+def processYearAndWeight(year, weighting, percents=None, thresholds=None, saveGraphs=False,
+        backbones=None, structure=None):
     timing = Timer('Running for year %d and weight %s' % (year, weighting))
-    adjMatFile = 'Data/Unipartite-Matrix/%d.%s' % (year, weighting)
-    sortedVals, N = getSortedMatrixVals(adjMatFile)
+    sortedVals, N = getSortedMatrixVals(year, weighting, structure=structure)
     timing.markEvent('Got sorted vals')
 
-    if percents:
-        for p in percents:
-            outfile = 'Data/Unipartite-Graphs/%d.%s_percent_%f.graph' \
-                    % (year, weighting, p)
-            graph = pruneGraphByPercent(sortedVals, N, p)
-            graph_funcs.saveGraph(graph, outfile)
-            timing.markEvent('Finished for %f percent' % p)
+    rows, cols, weights = sortedVals
+    cuts = [(kind, value) for numEdges, kind, value in getCutPoints(sortedVals, percents, thresholds)]
+    pruned_graphs.save(year, weighting, pruned_graphs.PrunedGraphs(rows, cols, weights, N, cuts))
+    timing.markEvent('Saved sorted edges and cut offsets')
 
-    if thresholds:
-        for t in thresholds:
-            outfile = 'Data/Unipartite-Graphs/%d.%s_threshold_%f.graph' \
-                    % (year, weighting, t)
-            graph = pruneGraphByThreshold(sortedVals, N, t)
+    if saveGraphs:
+        for kind, value, graph in pruneGraphsNested(sortedVals, N, percents, thresholds):
+            outfile = 'Data/Unipartite-Graphs/%s.graph' \
+                    % pruned_graphs.getLevelName(year, weighting, kind, value)
             graph_funcs.saveGraph(graph, outfile)
-            timing.markEvent('Finished for threshold %f' % t)
+            timing.markEvent('Finished for %s %f' % (kind, value))
+
+    if backbones and any(backbones.values()):
+        processBackbones(year, weighting, backbones, structure)
 
     timing.finish()
+    return timing.elapsed()
+
+# Dictionary from year to the (indptr, indices) structure shared by all the
+# weight matrices of that year. It is filled in before the worker processes are
+# forked, and the arrays are read-only memory maps, so every worker reads the
+# same physical pages instead of loading its own copy.
+sharedStructures = {}
+
+# Runs processYearAndWeight for one (year, weighting, keyword arguments) task in
+# a worker process. Returns the year, the weighting and the time taken in
+# seconds.
+def processTask(task):
+    year, weighting, kwargs = task
+    elapsed = processYearAndWeight(year, weighting, structure=sharedStructures.get(year), **kwargs)
+    return year, weighting, elapsed
+
+# Given the (year, weighting, seconds) results of every task and the Timer for
+# the whole run, prints the time taken by each task and the overall speedup.
+def printTimingReport(results, timing):
+    total = sum(elapsed for year, weighting, elapsed in results)
+    print 'Pruning timing report:'
+    for year, weighting, elapsed in sorted(results):
+        print '%d %-16s %10.2fs' % (year, weighting, elapsed)
+    print 'Sum of task times: %.2fs' % total
+    print 'Wall clock time: %.2fs' % timing.elapsed()
+    if timing.elapsed() > 0:
+        print 'Speedup: %.2fx' % (total / timing.elapsed())
 
 ################################################################################
 # Command-line behavior #
@@ -100,7 +250,8 @@ if __name__ == '__main__':
     percents = [0.01, 0.05, 0.1, 0.25, 0.5]
 
     # Dictionary from weighting function to the thresholds we'll use (based on
-    # pdf and cdf plots for that weight)
+    # pdf and cdf plots for that weight). Overridden for every weighting by
+    # `--thresholds`, whose values can also be quantiles, e.g. `q0.9,q0.99`.
     thresholdsDict = {
         'adamic': [np.exp(-1.5), np.exp(-1), 1],
         'cosine': [0.8, 0.95, 0.99],
@@ -109,7 +260,42 @@ if __name__ == '__main__':
         'weighted_adamic': [np.exp(6), np.exp(8), np.exp(9)],
     }
 
-    for arg in sys.argv[1:]:
-        year = int(arg)
+    # Pass --graphs to also save every pruned graph as a snap graph file, and
+    # --jobs <n> to prune the (year, weighting) pairs in n worker processes.
+    # Backbone graphs are generated for each k in `--topk 5,10` and each alpha
+    # in `--disparity 0.01,0.05`.
+    years, options = cli.parseArgs(sys.argv[1:], boolFlags=('graphs',))
+    saveGraphs = options.get('graphs', False)
+    jobs = int(options.get('jobs', 1))
+    thresholdSpecs = cli.parseList(options.get('thresholds'))
+    backbones = {
+        'topk': cli.parseList(options.get('topk'), int, []),
+        'disparity': cli.parseList(options.get('disparity'), float, []),
+    }
+
+    timing = Timer('pruning all weightings')
+    for year in years:
+        sharedStructures[year] = weight_store.loadStructure(year)
+
+    tasks = []
+    for year in years:
         for weighting, thresholds in thresholdsDict.iteritems():
-            processYearAndWeight(year, weighting, percents, thresholds)
+            if thresholdSpecs:
+                thresholds = resolveThresholds(year, weighting, thresholdSpecs)
+                print 'Thresholds %s for %d %s: %s' % (thresholdSpecs, year, weighting, thresholds)
+            tasks.append((year, weighting, {
+                'percents': percents,
+                'thresholds': thresholds,
+                'saveGraphs': saveGraphs,
+                'backbones': backbones,
+            }))
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.map(processTask, tasks, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        results = map(processTask, tasks)
+
+    timing.finish()
+    printTimingReport(results, timing)
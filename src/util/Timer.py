@@ -10,6 +10,9 @@ class Timer:
         print eventName
         print 'Current time elapsed: %f' % (time.time() - self.start)
 
+    def elapsed(self):
+        return time.time() - self.start
+
     def finish(self):
         print 'Finished %s' % self.name
         print 'Total time elapsed: %f' % (time.time() - self.start)
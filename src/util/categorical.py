@@ -1,5 +1,80 @@
 import snap, graph_funcs
 import numpy as np
+import scipy.sparse as sp
+
+# Function: getCategoryCodes
+# Params: values as list of categories (either ints or strings)
+# Returns: tuple of a numpy int array with the code of each value and the
+#          dictionary from category to code
+# ----------------------------------
+# Numbers the categories in the order they first appear in values, and returns
+# the code of every value.
+def getCategoryCodes(values):
+    categories = {}
+    codes = np.empty(len(values), dtype=np.int64)
+    for i, val in enumerate(values):
+        codes[i] = categories.setdefault(val, len(categories))
+    return codes, categories
+
+# Function: getOneHot
+# Params: codes as numpy int array of category codes
+#         numCategories as int
+#         sparse as optional bool indicating whether to return a scipy CSR
+#                matrix instead of a dense array (default)
+# Returns: len(codes) x (numCategories - 1) matrix
+# ----------------------------------
+# Builds the dummy variables of a batch of category codes in one go: one column
+# for each category but the last, which is all zeros.
+def getOneHot(codes, numCategories, sparse=False):
+    codes = np.asarray(codes, dtype=np.int64)
+    width = max(numCategories - 1, 0)
+    rows = np.flatnonzero(codes < width)
+    oneHot = sp.csr_matrix((np.ones(len(rows)), (rows, codes[rows])), shape=(len(codes), width))
+    return oneHot if sparse else oneHot.toarray()
+
+# Class: CategoricalFeature
+# ----------------------------------
+# The category code of every node in a set of nodes (see getCategoryCodes),
+# extracted once. Gives the dummy variables of any subset of those nodes with
+# getOneHot, and can be called with a single node id to get its feature vector.
+class CategoricalFeature:
+    def __init__(self, nodeIDs, codes, categories):
+        self.index = dict(zip(nodeIDs, range(len(nodeIDs))))
+        self.codes = codes
+        self.categories = categories
+
+    # Returns the number of dummy variables (columns).
+    def getWidth(self):
+        return max(len(self.categories) - 1, 0)
+
+    # Returns the array of category codes of the given node ids.
+    def getCodes(self, nodeIDs):
+        return self.codes[[self.index[nodeid] for nodeid in nodeIDs]]
+
+    # Returns the len(nodeIDs) x getWidth() matrix of dummy variables of the
+    # given node ids, as a scipy CSR matrix if sparse is True.
+    def getOneHot(self, nodeIDs, sparse=False):
+        return getOneHot(self.getCodes(nodeIDs), len(self.categories), sparse=sparse)
+
+    def __call__(self, nodeid):
+        return self.getOneHot([nodeid])[0]
+
+# Function: getOneHotBlock
+# Params: features as list of CategoricalFeature
+#         nodeIDs as list of node ids
+#         sparse as optional bool indicating whether to return a scipy CSR
+#                matrix instead of a dense array (default)
+# Returns: len(nodeIDs) x (total width of features) matrix
+# ----------------------------------
+# Puts the dummy variables of several categorical features side by side, in
+# the order of features.
+def getOneHotBlock(features, nodeIDs, sparse=False):
+    blocks = [feature.getOneHot(nodeIDs, sparse=True) for feature in features]
+    if not blocks:
+        block = sp.csr_matrix((len(nodeIDs), 0))
+    else:
+        block = sp.hstack(blocks, format='csr')
+    return block if sparse else block.toarray()
 
 # Function: getCategoricalFeatureVec
 # Params: featureFunc as function from int (node id in graph) to category
@@ -11,20 +86,20 @@ import numpy as np
 # categorical attribute. This is done using dummy variables for all but one of
 # the values that the string attribute can take.
 def getCategoricalFeatureVec(featureFunc, iterator):
-    categories = {}
-    # iteratorFunc = graph_funcs.getRecipients if isRecip else graph_funcs.getDonors
+    codes, categories = getCategoryCodes([featureFunc(node.GetId()) for node in iterator])
+    return lambda cat: getOneHot([categories[cat]], len(categories))[0]
 
-    for node in iterator:
-        val = featureFunc(node.GetId())
-        if val not in categories: categories[val] = len(categories)
-
-    def getFeatures(cat):
-        features = np.zeros(len(categories) - 1)
-        index = categories[cat]
-        if index < len(features): features[index] = 1
-        return features
-
-    return getFeatures
+# Function: getAttrFeature
+# Params: featureFunc as function from int (node id in graph) to category
+#                        (either int or string)
+#         iterator as iterable of nodes expressing all the desired categories
+# Returns: CategoricalFeature of the nodes in iterator
+# ----------------------------------
+# Extracts the category of every node in iterator in one pass.
+def getAttrFeature(featureFunc, iterator):
+    nodeIDs = [node.GetId() for node in iterator]
+    codes, categories = getCategoryCodes([featureFunc(nodeid) for nodeid in nodeIDs])
+    return CategoricalFeature(nodeIDs, codes, categories)
 
 # Function: getIntAttrFeatureVec
 # Params: graph as snap.TNEANet graph
@@ -35,16 +110,15 @@ def getCategoricalFeatureVec(featureFunc, iterator):
 #                 recipient nodes (default) or only full nodes.
 #         cfs as optional bool indicating whether to restrict yourself to nodes
 #                with valid cfscores (default) or not
-# Returns: function from category (either int or string) to a numpy vector
+# Returns: CategoricalFeature, which can also be called as a function from node
+#          id to a numpy vector
 # ------------------------------
-# Convenience wrapper around getCategoricalFeatureVec for the common case of
-# a categorical int node attribute in the bipartite graph.
+# Convenience wrapper around getAttrFeature for the common case of a
+# categorical int node attribute in the bipartite graph.
 def getIntAttrFeatureVec(graph, attr, isRecip=True, full=False, cfs=True):
     featureFunc = lambda nodeid: graph.GetIntAttrDatN(nodeid, attr)
     iteratorFunc = graph_funcs.getRecipients if isRecip else graph_funcs.getDonors
-    iterator = iteratorFunc(graph, cfs=cfs, full=full)
-    catFunc = getCategoricalFeatureVec(featureFunc, iterator)
-    return lambda nodeid: catFunc(featureFunc(nodeid))
+    return getAttrFeature(featureFunc, iteratorFunc(graph, cfs=cfs, full=full))
 
 # Function: getStrAttrFeatureVec
 # Params: graph as snap.TNEANet graph
@@ -55,13 +129,12 @@ def getIntAttrFeatureVec(graph, attr, isRecip=True, full=False, cfs=True):
 #                 recipient nodes (default) or only full nodes.
 #         cfs as optional bool indicating whether to restrict yourself to nodes
 #                with valid cfscores (default) or not
-# Returns: function from category (either int or string) to a numpy vector
+# Returns: CategoricalFeature, which can also be called as a function from node
+#          id to a numpy vector
 # ------------------------------
-# Convenience wrapper around getCategoricalFeatureVec for the common case of
-# a categorical string node attribute in the bipartite graph.
+# Convenience wrapper around getAttrFeature for the common case of a
+# categorical string node attribute in the bipartite graph.
 def getStrAttrFeatureVec(graph, attr, isRecip=True, full=False, cfs=True):
     featureFunc = lambda nodeid: graph.GetStrAttrDatN(nodeid, attr)
     iteratorFunc = graph_funcs.getRecipients if isRecip else graph_funcs.getDonors
-    iterator = iteratorFunc(graph, cfs=cfs, full=full)
-    catFunc = getCategoricalFeatureVec(featureFunc, iterator)
-    return lambda nodeid: catFunc(featureFunc(nodeid))
+    return getAttrFeature(featureFunc, iteratorFunc(graph, cfs=cfs, full=full))
@@ -0,0 +1,35 @@
+# Module: cli
+# Minimal command-line parsing shared by the pipeline scripts. Every script takes
+# the years to process as positional arguments; options are given either as
+# `--name=value`, `--name value`, or (for boolean flags) a bare `--name`.
+
+# Splits argv into the list of years and a dictionary from option name to value.
+# Options listed in boolFlags take no value and are set to True when present.
+def parseArgs(argv, boolFlags=()):
+    years = []
+    options = {}
+
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg.startswith('--'):
+            name, hasValue, value = arg[2:].partition('=')
+            if not hasValue:
+                if name in boolFlags:
+                    value = True
+                else:
+                    i += 1
+                    value = argv[i]
+            options[name] = value
+        else:
+            years.append(int(arg))
+        i += 1
+
+    return years, options
+
+# Splits a comma-separated option value into a list, converting each element
+# with convert (e.g. float). Returns default if the option wasn't given.
+def parseList(value, convert=str, default=None):
+    if value is None:
+        return default
+    return [convert(v) for v in value.split(',') if v]
@@ -0,0 +1,152 @@
+# Module: communities
+# Community detection on the sparse (optionally weighted) symmetric adjacency
+# matrix of a unipartite graph, as a fast alternative to snap.CommunityCNM:
+#
+#   louvain:           greedy modularity optimization by local node moves,
+#                      repeated on the graph of the communities found
+#   labelPropagation:  every node repeatedly adopts the label with the most
+#                      (weighted) support among its neighbors
+#
+# Both visit the nodes in a random order drawn from seed, so runs with the same
+# seed are repeatable, and both return an array of community labels aligned to
+# the node ids.
+
+import numpy as np
+import scipy.sparse as sp
+from collections import defaultdict
+
+# Returns the N x K sparse 0/1 membership matrix of the community labels
+# (relabelled to 0..K-1).
+def _getMembership(labels):
+    uniqueLabels, labels = np.unique(labels, return_inverse=True)
+    N = len(labels)
+    return sp.csr_matrix((np.ones(N), (np.arange(N), labels)), shape=(N, len(uniqueLabels)))
+
+# Returns the modularity of the community labels of a graph with adjacency
+# matrix adj.
+def getModularity(adj, labels):
+    membership = _getMembership(labels)
+    total = adj.sum()
+    if total == 0:
+        return 0.0
+    communityAdj = membership.T.dot(adj).dot(membership)
+    communityTotals = np.asarray(communityAdj.sum(axis=1)).ravel()
+    return (communityAdj.diagonal().sum() - np.dot(communityTotals, communityTotals) / total) / total
+
+# One local moving phase of Louvain: each node (in random order) is moved to the
+# neighboring community with the largest modularity gain, until a full sweep
+# moves no node. Starts from every node in its own community, or from the given
+# labels (in 0..N-1). Returns the array of community labels and whether any
+# node moved.
+def _moveNodes(adj, rng, tol, maxSweeps, labels=None):
+    N = adj.shape[0]
+    indptr, indices, data = adj.indptr.tolist(), adj.indices.tolist(), adj.data.tolist()
+    degrees = np.asarray(adj.sum(axis=1), dtype=np.float64).ravel()
+    if labels is None:
+        labels = np.arange(N)
+    communities = labels.tolist()
+    communityTotals = np.bincount(labels, weights=degrees, minlength=N).tolist()
+    degrees = degrees.tolist()
+    total = sum(degrees)
+    if total == 0:
+        return np.array(communities), False
+
+    moved = False
+    for sweep in xrange(maxSweeps):
+        improved = False
+        for node in rng.permutation(N).tolist():
+            degree = degrees[node]
+            current = communities[node]
+
+            links = defaultdict(float)
+            for i in xrange(indptr[node], indptr[node + 1]):
+                neighbor = indices[i]
+                if neighbor != node:
+                    links[communities[neighbor]] += data[i]
+
+            communityTotals[current] -= degree
+            best = current
+            bestGain = links.get(current, 0.0) - communityTotals[current] * degree / total
+            for community, weight in links.iteritems():
+                gain = weight - communityTotals[community] * degree / total
+                if gain > bestGain + tol:
+                    best, bestGain = community, gain
+            communityTotals[best] += degree
+
+            if best != current:
+                communities[node] = best
+                improved = moved = True
+        if not improved:
+            break
+
+    return np.array(communities), moved
+
+# Louvain community detection. Alternates local moving phases with aggregating
+# each community into a single node (adding up the edge weights between them),
+# until no node moves, then refines the result with a final moving phase over
+# the original nodes. Returns the array of community labels.
+def louvain(adj, seed=None, tol=1e-10, maxLevels=20, maxSweeps=50):
+    rng = np.random.RandomState(seed)
+    adj = sp.csr_matrix(adj, dtype=np.float64)
+    originalAdj = adj
+    labels = np.arange(adj.shape[0])
+
+    for level in xrange(maxLevels):
+        communities, moved = _moveNodes(adj, rng, tol, maxSweeps)
+        if not moved:
+            break
+        membership = _getMembership(communities)
+        labels = membership.indices[labels]
+        adj = membership.T.dot(adj).dot(membership).tocsr()
+
+    if level > 0:
+        labels, moved = _moveNodes(originalAdj, rng, tol, maxSweeps, labels)
+    return labels
+
+# Label propagation community detection. Every node starts in its own community
+# and, in random order, takes the label with the largest total edge weight among
+# its neighbors (ties broken at random, keeping its own label if it is among
+# them), until a full sweep changes no label. Returns the array of community
+# labels.
+def labelPropagation(adj, seed=None, maxSweeps=100):
+    rng = np.random.RandomState(seed)
+    adj = sp.csr_matrix(adj, dtype=np.float64)
+    N = adj.shape[0]
+    indptr, indices, data = adj.indptr.tolist(), adj.indices.tolist(), adj.data.tolist()
+    labels = range(N)
+
+    for sweep in xrange(maxSweeps):
+        changed = False
+        for node in rng.permutation(N).tolist():
+            if indptr[node] == indptr[node + 1]:
+                continue
+
+            support = defaultdict(float)
+            for i in xrange(indptr[node], indptr[node + 1]):
+                support[labels[indices[i]]] += data[i]
+
+            mostSupport = max(support.itervalues())
+            candidates = sorted(label for label, weight in support.iteritems() if weight >= mostSupport)
+            if labels[node] in candidates:
+                continue
+            labels[node] = candidates[rng.randint(len(candidates))]
+            changed = True
+        if not changed:
+            break
+
+    return np.array(labels)
+
+# Given an array of community labels, returns a dictionary from node id to
+# community index in the format of the snap-based labelers in feature_extractor:
+# nodes alone in their community get 0.0, and the other communities are
+# numbered from 1 in order of their smallest node id.
+def toCommunityDict(labels):
+    uniqueLabels, firstNodes, labels, sizes = np.unique(labels, return_index=True,
+            return_inverse=True, return_counts=True)
+    indices = np.empty(len(uniqueLabels), dtype=np.int64)
+    indices[np.argsort(firstNodes, kind='mergesort')] = np.arange(1, len(uniqueLabels) + 1)
+
+    communities = {}
+    for nid, label in enumerate(labels.tolist()):
+        communities[nid] = 0.0 if sizes[label] == 1 else int(indices[label])
+    return communities
@@ -0,0 +1,151 @@
+# Module: donor_aggregates
+# The per-cycle donor/recipient aggregates of the bipartite graph (how much and
+# how many times each donor gave to each recipient), computed in one pass over
+# the bipartite graph's edges and shared by donor_relationships,
+# feature_extractor and recip_feature_extractor. They are stored as a donor x
+# recipient CSR matrix with two value columns:
+#
+#   Data/Aggregates/<year>.donors.npy        cnodeid of each row
+#   Data/Aggregates/<year>.recips.npy        rnodeid of each column
+#   Data/Aggregates/<year>.indptr.npy        CSR row pointers
+#   Data/Aggregates/<year>.indices.npy       CSR column indices
+#   Data/Aggregates/<year>.amounts.npy       total amount per (donor, recipient)
+#   Data/Aggregates/<year>.transactions.npy  number of donations per (donor, recipient)
+#   Data/Aggregates/<year>.meta              size and mtime of the bipartite graph file
+#
+# The arrays are loaded as read-only memory maps. They are recomputed
+# automatically whenever the bipartite graph file's size or modification time
+# no longer matches the one they were computed from.
+
+import os
+import numpy as np
+import scipy.sparse as sp
+from collections import defaultdict
+import graph_funcs, pickler
+
+AGGREGATES_DIR = 'Data/Aggregates'
+ARRAYS = ('donors', 'recips', 'indptr', 'indices', 'amounts', 'transactions')
+
+# The donor infos getInfos can build. Each is a dictionary, from:
+# 'numDonations': cnodeid to the total number of donations that donor made
+# 'totalAmount': cnodeid to the total amount that donor donated
+# 'cands': cnodeid to the set of rnodeids that donor gave to
+# 'transactions': cnodeid to a dictionary showing how many donations the donor
+#                 made to each rnodeid
+# 'amounts': cnodeid to a dictionary showing how much the donor gave to each
+#            rnodeid
+# 'totalReceipts': rnodeid to the total amount received in donations by that
+#                  candidate
+DONOR_INFOS = ('numDonations', 'totalAmount', 'cands', 'transactions', 'amounts', 'totalReceipts')
+
+class DonorAggregates:
+    def __init__(self, donors, recips, indptr, indices, amounts, transactions):
+        self.donors = donors
+        self.recips = recips
+        self.indptr = indptr
+        self.indices = indices
+        self.amounts = amounts
+        self.transactions = transactions
+
+    # Returns the donor x recipient CSR matrix of total amounts given (or of
+    # numbers of donations, if values is 'transactions').
+    def getMatrix(self, values='amounts'):
+        return sp.csr_matrix((getattr(self, values), self.indices, self.indptr),
+                shape=(len(self.donors), len(self.recips)))
+
+    # Returns the array of total amounts donated by each donor (row).
+    def getTotalAmounts(self):
+        return np.asarray(self.getMatrix().sum(axis=1)).ravel()
+
+    # Returns the array of total amounts received by each recipient (column).
+    def getTotalReceipts(self):
+        return np.bincount(self.indices, weights=self.amounts, minlength=len(self.recips)).astype(np.int64)
+
+    # Returns a dictionary from cnodeid to row index.
+    def getDonorIndex(self):
+        return dict(zip(self.donors.tolist(), range(len(self.donors))))
+
+    # Returns a dictionary from rnodeid to column index.
+    def getRecipIndex(self):
+        return dict(zip(self.recips.tolist(), range(len(self.recips))))
+
+    # Given the names of the donor infos to build (see DONOR_INFOS), returns a
+    # dictionary from info name to the info. These are plain (picklable)
+    # dictionaries for code that looks up individual donors and recipients.
+    def getInfos(self, names=DONOR_INFOS):
+        infos = {}
+        donors = self.donors.tolist()
+        recips = self.recips.tolist()
+        indptr = self.indptr.tolist()
+        indices = self.indices.tolist()
+
+        if 'totalAmount' in names:
+            infos['totalAmount'] = defaultdict(int, zip(donors, self.getTotalAmounts().tolist()))
+        if 'numDonations' in names:
+            numDonations = np.asarray(self.getMatrix('transactions').sum(axis=1)).ravel()
+            infos['numDonations'] = defaultdict(int, zip(donors, numDonations.tolist()))
+        if 'totalReceipts' in names:
+            infos['totalReceipts'] = defaultdict(int, zip(recips, self.getTotalReceipts().tolist()))
+
+        for name, values in (('cands', None), ('amounts', self.amounts), ('transactions', self.transactions)):
+            if name not in names: continue
+            values = values.tolist() if values is not None else None
+            info = defaultdict(set) if values is None else defaultdict(dict)
+            for row, cnodeid in enumerate(donors):
+                start, end = indptr[row], indptr[row + 1]
+                rids = [recips[col] for col in indices[start:end]]
+                if values is None:
+                    info[cnodeid] = set(rids)
+                else:
+                    info[cnodeid] = dict(zip(rids, values[start:end]))
+            infos[name] = info
+
+        return infos
+
+# Computes the aggregates of a bipartite donor-candidate graph in a single pass
+# over its edges.
+def fromGraph(graph):
+    donations = np.array([(edge.GetSrcNId(), edge.GetDstNId(), graph.GetIntAttrDatE(edge, 'amount')) \
+            for edge in graph.Edges()], dtype=np.int64).reshape(-1, 3)
+    donors, donorIndices = np.unique(donations[:, 0], return_inverse=True)
+    recips, recipIndices = np.unique(donations[:, 1], return_inverse=True)
+    shape = (len(donors), len(recips))
+
+    # Converting to CSR sums the duplicate (donor, recipient) entries
+    amounts = sp.csr_matrix((donations[:, 2], (donorIndices, recipIndices)), shape=shape)
+    transactions = sp.csr_matrix((np.ones(len(donations), dtype=np.int64),
+            (donorIndices, recipIndices)), shape=shape)
+    amounts.sort_indices()
+    transactions.sort_indices()
+
+    return DonorAggregates(donors, recips, amounts.indptr, amounts.indices,
+            amounts.data, transactions.data)
+
+def _path(year, name):
+    return '%s/%d.%s' % (AGGREGATES_DIR, year, name)
+
+# Returns the (size, mtime) signature of a year's bipartite graph file.
+def _graphSignature(year):
+    stat = os.stat('Data/Bipartite-Graphs/%d.graph' % year)
+    return stat.st_size, stat.st_mtime
+
+# Returns the aggregates for a year, memory-mapped from Data/Aggregates. If they
+# haven't been saved yet or the bipartite graph has changed since, they are
+# recomputed (from graph if given, otherwise from the loaded bipartite graph)
+# and saved first.
+def load(year, graph=None):
+    signature = _graphSignature(year)
+    try:
+        upToDate = pickler.load(_path(year, 'meta')) == signature
+    except IOError:
+        upToDate = False
+
+    if not upToDate:
+        if graph is None:
+            graph = graph_funcs.loadGraph('Data/Bipartite-Graphs/%d.graph' % year)
+        aggregates = fromGraph(graph)
+        for name in ARRAYS:
+            np.save(_path(year, name + '.npy'), getattr(aggregates, name))
+        pickler.save(signature, _path(year, 'meta'))
+
+    return DonorAggregates(*[np.load(_path(year, name + '.npy'), mmap_mode='r') for name in ARRAYS])
@@ -0,0 +1,61 @@
+# Module: feature_matrix
+# Dense storage for the donor features of a pruned graph: one row of floats per
+# donor instead of a dictionary of Python lists. A feature matrix is saved as
+#
+#   <prefix>.X.npy     the donors x features float64 array
+#   <prefix>.ids.npy   the cnodeid of each row
+#   <prefix>.columns   the list of feature (column) names
+#
+# where prefix is e.g. Data/Features/<level>, and loaded with X and ids as
+# read-only memory maps.
+
+import numpy as np
+import pickler
+
+class FeatureMatrix:
+    def __init__(self, X, ids, columns):
+        self.X = X
+        self.ids = ids
+        self.columns = list(columns)
+        self.index = None
+
+    # Returns a dictionary from node id to row index.
+    def getIndex(self):
+        if self.index is None:
+            self.index = dict(zip(self.ids.tolist(), range(len(self.ids))))
+        return self.index
+
+    # Returns the len(ids) x features array of the rows of the given node ids.
+    def getRows(self, ids):
+        index = self.getIndex()
+        return self.X[[index[nid] for nid in ids]]
+
+    # Returns the feature vector of one node id.
+    def getRow(self, nid):
+        return self.X[self.getIndex()[nid]]
+
+    # Returns the column of one feature name.
+    def getColumn(self, name):
+        return self.X[:, self.columns.index(name)]
+
+# Given a dictionary from node id to feature vector and the feature names,
+# returns the FeatureMatrix with one row per node id (in the order of ids, if
+# given).
+def fromDict(features, columns, ids=None):
+    if ids is None:
+        ids = sorted(features)
+    X = np.array([features[nid] for nid in ids], dtype=np.float64).reshape(len(ids), len(columns))
+    return FeatureMatrix(X, np.asarray(ids, dtype=np.int64), columns)
+
+# Saves a FeatureMatrix under a filename prefix.
+def save(featureMatrix, prefix):
+    np.save(prefix + '.X.npy', featureMatrix.X)
+    np.save(prefix + '.ids.npy', featureMatrix.ids)
+    pickler.save(featureMatrix.columns, prefix + '.columns')
+
+# Loads the FeatureMatrix saved under a filename prefix, memory-mapped unless
+# mmap is False.
+def load(prefix, mmap=True):
+    mode = 'r' if mmap else None
+    return FeatureMatrix(np.load(prefix + '.X.npy', mmap_mode=mode),
+            np.load(prefix + '.ids.npy', mmap_mode=mode), pickler.load(prefix + '.columns'))
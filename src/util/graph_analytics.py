@@ -0,0 +1,308 @@
+# Module: graph_analytics
+# Array-native analytics for the unipartite donor graphs. Everything works on
+# the symmetric CSR adjacency matrix of the graph, whose row/column indices are
+# the unipartite node ids, and returns NumPy arrays aligned to those node ids.
+
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as linalg
+from scipy.sparse import csgraph
+import graph_funcs
+
+# Given the two endpoint arrays of the undirected edges of a graph with node ids
+# 0..N-1, returns its symmetric N x N CSR adjacency matrix. The values are the
+# edge weights if given, and ones otherwise.
+def getAdjacency(rows, cols, N, weights=None):
+    data = np.ones(len(rows)) if weights is None else np.asarray(weights, dtype=np.float64)
+    upper = sp.csr_matrix((data, (rows, cols)), shape=(N, N))
+    return (upper + upper.T).tocsr()
+
+# Returns the array of node degrees (number of edges per node).
+def getDegrees(adj):
+    return np.diff(adj.indptr)
+
+# Returns the array of node strengths (sum of the edge weights per node).
+def getStrengths(adj):
+    return np.asarray(adj.sum(axis=1), dtype=np.float64).ravel()
+
+# Returns the number of connected components and the array of the component
+# label of each node, found in a single linear-time traversal.
+def getConnectedComponents(adj):
+    return csgraph.connected_components(adj, directed=False)
+
+# Given the component labels of the nodes, returns the array of the size of
+# each node's component.
+def getComponentSizes(labels):
+    return np.bincount(labels)[labels]
+
+# The cap on the number of entries of the sparse products computed at once by
+# getTriangles and getNodesAtHop2 (about 12 bytes each).
+MAX_BLOCK_ENTRIES = 1 << 24
+
+# Given an unweighted adjacency matrix, yields (start, end) ranges of rows such
+# that the product of each block of rows with the adjacency matrix has at most
+# maxBlockEntries entries (the number of 2-paths starting from the block's rows
+# bounds it), except for single rows that exceed it on their own.
+def getRowBlocks(adj, maxBlockEntries=MAX_BLOCK_ENTRIES):
+    pathCounts = np.cumsum(adj.dot(getDegrees(adj).astype(np.float64)))
+    start = 0
+    while start < adj.shape[0]:
+        offset = pathCounts[start - 1] if start > 0 else 0.0
+        end = max(int(np.searchsorted(pathCounts, offset + maxBlockEntries, side='right')), start + 1)
+        yield start, end
+        start = end
+
+# Returns the array of the number of triangles each node is in, for an
+# unweighted adjacency matrix with no self loops. For each block of rows, the
+# 2-paths from those rows (their rows of A^2) are restricted to the existing
+# edges, and each triangle is counted twice.
+def getTriangles(adj, maxBlockEntries=MAX_BLOCK_ENTRIES):
+    triangles = np.zeros(adj.shape[0])
+    for start, end in getRowBlocks(adj, maxBlockEntries):
+        block = adj[start:end]
+        triangles[start:end] = np.asarray(block.dot(adj).multiply(block).sum(axis=1)).ravel() / 2
+    return triangles
+
+# Returns the array of local clustering coefficients: the fraction of the pairs
+# of each node's neighbors that are connected (0 for nodes with fewer than two
+# neighbors, as in snap.GetNodeClustCf).
+def getClustering(adj, triangles=None, degrees=None):
+    if triangles is None:
+        triangles = getTriangles(adj)
+    if degrees is None:
+        degrees = getDegrees(adj)
+    clustering = np.zeros(adj.shape[0])
+    nodeids = np.flatnonzero(degrees > 1)
+    degrees = degrees[nodeids].astype(np.float64)
+    clustering[nodeids] = 2 * triangles[nodeids] / (degrees * (degrees - 1))
+    return clustering
+
+# Returns the array of the number of nodes at distance exactly 2 from each node
+# (as snap.GetNodesAtHop with hop 2), for an unweighted adjacency matrix with no
+# self loops: the nodes reached by 2-paths or edges, other than the node itself,
+# minus its neighbors. Computed in blocks of rows like getTriangles.
+def getNodesAtHop2(adj, maxBlockEntries=MAX_BLOCK_ENTRIES):
+    counts = np.zeros(adj.shape[0])
+    degrees = getDegrees(adj)
+    for start, end in getRowBlocks(adj, maxBlockEntries):
+        block = adj[start:end]
+        reach = block.dot(adj) + block
+        reach.eliminate_zeros()
+        selfReached = np.asarray(reach[:, start:end].diagonal() != 0, dtype=np.float64)
+        counts[start:end] = np.diff(reach.indptr) - selfReached - degrees[start:end]
+    return counts
+
+# Computes PageRank by sparse power iteration. Each node passes damping times
+# its rank to its neighbors, split evenly (or in proportion to the edge weights
+# if weighted is True), and the rank that leaks out (the teleport share and the
+# rank of nodes with no edges) is spread evenly over all the nodes, as in
+# snap.GetPageRank. Iterates until the L1 change is below tol or maxIter is
+# reached. start is an optional initial rank vector (e.g. the PageRank of a
+# closely related graph) to warm start from. Returns the array of ranks.
+def getPageRank(adj, weighted=False, damping=0.85, tol=1e-4, maxIter=100, start=None):
+    N = adj.shape[0]
+    if N == 0:
+        return np.zeros(0)
+
+    if not weighted:
+        adj = sp.csr_matrix((np.ones(len(adj.indices)), adj.indices, adj.indptr), shape=adj.shape)
+    outWeights = np.asarray(adj.sum(axis=1), dtype=np.float64).ravel()
+    with np.errstate(divide='ignore'):
+        scale = np.where(outWeights > 0, damping / outWeights, 0.0)
+    transition = sp.diags(scale).dot(adj).T.tocsr()
+
+    if start is None:
+        ranks = np.repeat(1.0 / N, N)
+    else:
+        ranks = np.asarray(start, dtype=np.float64) / np.sum(start)
+
+    for i in range(maxIter):
+        newRanks = transition.dot(ranks)
+        newRanks += (1.0 - newRanks.sum()) / N
+        change = np.abs(newRanks - ranks).sum()
+        ranks = newRanks
+        if change < tol:
+            break
+
+    return ranks
+
+# Returns the unweighted adjacency matrix of a snap.TUNGraph whose node ids are
+# 0..N-1 (N defaults to graph.GetMxNId()). Its edge arrays (see
+# graph_funcs.getEdgeArrays) can be passed in if they are already known.
+def fromGraph(graph, N=None, edges=None):
+    if edges is None:
+        edges = graph_funcs.getEdgeArrays(graph)
+    if N is None:
+        N = graph.GetMxNId()
+    rows, cols = edges
+    return getAdjacency(rows, cols, N)
+
+# Components up to this size are solved with a dense eigendecomposition rather
+# than an iterative sparse eigensolver.
+DENSE_EIGEN_SIZE = 100
+
+# Returns the array of the node ids in the largest connected component.
+def getGiantComponent(adj):
+    numComponents, labels = getConnectedComponents(adj)
+    return np.flatnonzero(labels == np.argmax(np.bincount(labels)))
+
+# Returns the eigenvalues and eigenvectors (as columns) of the k largest
+# eigenvalues of a symmetric sparse matrix, in decreasing order. Small matrices
+# are solved densely. Otherwise ARPACK is used, or LOBPCG warm started from the
+# given n x k block of starting vectors.
+def _getLargestEigenvectors(matrix, k, start=None, tol=1e-6):
+    n = matrix.shape[0]
+    if n <= DENSE_EIGEN_SIZE:
+        values, vectors = np.linalg.eigh(matrix.toarray())
+        values, vectors = values[n - k:], vectors[:, n - k:]
+    elif start is None:
+        values, vectors = linalg.eigsh(matrix, k=k, which='LA', tol=tol)
+    elif k == 1:
+        values, vectors = linalg.eigsh(matrix, k=k, which='LA', tol=tol, v0=start[:, 0])
+    else:
+        values, vectors = linalg.lobpcg(matrix, start, tol=tol, maxiter=200, largest=True)
+    order = np.argsort(-values, kind='mergesort')
+    return values[order], vectors[:, order]
+
+# Flips the sign of each column of vectors so that its largest entry (in
+# absolute value) is positive, to make eigenvectors comparable across runs.
+def _fixSigns(vectors):
+    largest = vectors[np.argmax(np.abs(vectors), axis=0), np.arange(vectors.shape[1])]
+    return vectors * np.where(largest < 0, -1.0, 1.0)
+
+# Returns the restriction of the rows of a previous result (an array with one
+# row per node id) to nodeids, as an n x k starting block for an eigensolver.
+# Nodes that had no value yet (new to the component) get a small constant so
+# that no starting vector is zero.
+def _getStartBlock(start, nodeids):
+    block = np.asarray(start, dtype=np.float64).reshape(len(start), -1)[nodeids]
+    return block + 1e-3 / np.sqrt(len(nodeids))
+
+# Returns the array of eigenvector centralities of a (weighted) adjacency
+# matrix: the leading eigenvector of the giant component's adjacency matrix,
+# normalized to unit length, and 0 for the nodes outside the giant component.
+# start is an optional previous centrality vector (e.g. of a sparser graph of
+# the same nodes) to warm start the eigensolver from.
+def getEigenvectorCentrality(adj, start=None, tol=1e-6):
+    centrality = np.zeros(adj.shape[0])
+    nodeids = getGiantComponent(adj)
+    if len(nodeids) < 2:
+        return centrality
+
+    component = adj[nodeids][:, nodeids].astype(np.float64)
+    startBlock = _getStartBlock(start, nodeids) if start is not None else None
+    values, vectors = _getLargestEigenvectors(component, 1, startBlock, tol)
+
+    # The leading eigenvector of a connected graph has entries of a single sign
+    vector = np.abs(vectors[:, 0])
+    centrality[nodeids] = vector / np.linalg.norm(vector)
+    return centrality
+
+# Returns the dims-dimensional spectral embedding (Laplacian eigenmap) of the
+# giant component of a (weighted) adjacency matrix. It uses the eigenvectors of
+# the normalized adjacency matrix D^-1/2 A D^-1/2 with the largest eigenvalues
+# after the trivial one (those of the smallest nonzero eigenvalues of the
+# normalized Laplacian), scaled by D^-1/2. Nodes outside the giant component are
+# placed at the origin. Returns the N x dims embedding and the N x (dims + 1)
+# block of eigenvectors, which can be passed back in as start to warm start
+# LOBPCG on a closely related graph (e.g. the next nested pruning level).
+def getSpectralEmbedding(adj, dims=2, start=None, tol=1e-6):
+    N = adj.shape[0]
+    embedding = np.zeros((N, dims))
+    basis = np.zeros((N, dims + 1))
+    nodeids = getGiantComponent(adj)
+    if len(nodeids) <= dims + 1:
+        return embedding, basis
+
+    component = adj[nodeids][:, nodeids].astype(np.float64)
+    scale = 1.0 / np.sqrt(np.asarray(component.sum(axis=1)).ravel())
+    normalized = sp.diags(scale).dot(component).dot(sp.diags(scale)).tocsr()
+    startBlock = _getStartBlock(start, nodeids) if start is not None else None
+    values, vectors = _getLargestEigenvectors(normalized, dims + 1, startBlock, tol)
+
+    vectors = _fixSigns(vectors)
+    basis[nodeids] = vectors
+    embedding[nodeids] = _fixSigns(scale[:, np.newaxis] * vectors[:, 1:])
+    return embedding, basis
+
+# Given the component labels of a graph (numbered from 0 in order of each
+# component's smallest node id, as getConnectedComponents returns them) and the
+# endpoint arrays of edges added to it, returns the component labels of the
+# grown graph, numbered the same way. Like a union-find, only the new edges are
+# visited: the ones joining two different components are contracted to edges
+# between component labels, and the merged groups are found on that (much
+# smaller) graph of components.
+def mergeComponents(labels, rows, cols):
+    srcs, dsts = labels[rows], labels[cols]
+    joining = srcs != dsts
+    if not joining.any():
+        return labels
+    K = labels.max() + 1
+    links = sp.csr_matrix((np.ones(np.count_nonzero(joining)), (srcs[joining], dsts[joining])), shape=(K, K))
+    numComponents, merged = csgraph.connected_components(links, directed=False)
+    return merged[labels]
+
+# The analytics of a graph with node ids 0..N-1 that grows by having edges added
+# to it, as when walking the nested pruning levels of a weighting from the
+# sparsest to the densest. Each update only visits the edges added since the
+# previous one: degrees and weight sums are incremented, components merged, and
+# the PageRank, eigenvector centrality and spectral embedding of the previous
+# level are kept to warm start the next one.
+class GraphGrowth:
+    def __init__(self, N):
+        self.N = N
+        self.numEdges = 0
+        self.rows = self.cols = np.zeros(0, dtype=np.int64)
+        self.degrees = np.zeros(N, dtype=np.int64)
+        self.strengths = np.zeros(N)
+        self.components = np.arange(N)
+        self.pageRank = None
+        self.eigenvector = None
+        self.spectralBasis = None
+
+    # Given the edge arrays of the grown graph, whose first numEdges edges are
+    # the edges of the current graph (e.g. a longer prefix of the same sorted
+    # edges), adds the rest.
+    def update(self, rows, cols, weights):
+        newRows = np.asarray(rows[self.numEdges:])
+        newCols = np.asarray(cols[self.numEdges:])
+        newWeights = np.asarray(weights[self.numEdges:], dtype=np.float64)
+
+        self.degrees += np.bincount(newRows, minlength=self.N) + np.bincount(newCols, minlength=self.N)
+        self.strengths += np.bincount(newRows, weights=newWeights, minlength=self.N) \
+                + np.bincount(newCols, weights=newWeights, minlength=self.N)
+        self.components = mergeComponents(self.components, newRows, newCols)
+        self.rows, self.cols = rows, cols
+        self.numEdges = len(rows)
+
+    # Returns the unweighted adjacency matrix of the current graph.
+    def getAdjacency(self):
+        return getAdjacency(self.rows, self.cols, self.N)
+
+    # Returns a dictionary from node id to the average weight of its edges, for
+    # every node with at least one edge.
+    def getAverageWeights(self):
+        nodeids = np.flatnonzero(self.degrees)
+        return dict(zip(nodeids.tolist(), (self.strengths[nodeids] / self.degrees[nodeids]).tolist()))
+
+    # Returns the PageRank of the current graph, warm started from the PageRank
+    # of the previous one.
+    def getPageRank(self, adj=None):
+        if adj is None:
+            adj = self.getAdjacency()
+        self.pageRank = getPageRank(adj, start=self.pageRank)
+        return self.pageRank
+
+    # Returns the eigenvector centrality of the current graph with weighted
+    # adjacency matrix adj, warm started from that of the previous one.
+    def getEigenvectorCentrality(self, adj):
+        self.eigenvector = getEigenvectorCentrality(adj, start=self.eigenvector)
+        return self.eigenvector
+
+    # Returns the spectral embedding of the current graph with weighted
+    # adjacency matrix adj, warm started from that of the previous one.
+    def getSpectralEmbedding(self, adj, dims=2):
+        if self.spectralBasis is not None and self.spectralBasis.shape[1] != dims + 1:
+            self.spectralBasis = None
+        embedding, self.spectralBasis = getSpectralEmbedding(adj, dims, start=self.spectralBasis)
+        return embedding
@@ -1,4 +1,5 @@
-import snap
+import snap, os, tempfile
+import numpy as np
 
 ################################################################################
 # Miscellaneous helpful snap.py graph functions #
@@ -15,6 +16,40 @@ def saveGraph(graph, filename):
     graph.Save(FOut)
     FOut.Flush()
 
+# Appends the undirected edges given by two arrays of node ids to an open edge
+# list file, one tab-separated edge per line.
+def writeEdgeList(f, rows, cols):
+    np.savetxt(f, np.column_stack((rows, cols)), fmt='%d', delimiter='\t')
+
+# Loads an undirected snap graph from an edge list file in bulk and adds any of
+# the nodes 0..N-1 that have no edges, so the node ids match the unipartite
+# node ids.
+def loadEdgeListGraph(filename, N):
+    graph = snap.LoadEdgeList(snap.PUNGraph, filename, 0, 1)
+    for nid in xrange(N):
+        if not graph.IsNode(nid):
+            graph.AddNode(nid)
+    return graph
+
+# Creates an undirected snap graph with nodes 0..N-1 and the edges given by two
+# arrays of node ids. The edges are written to a temporary edge list and loaded
+# by snap in one call instead of being added one at a time.
+def graphFromEdgeArrays(rows, cols, N):
+    fd, filename = tempfile.mkstemp(suffix='.edges')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            writeEdgeList(f, rows, cols)
+        return loadEdgeListGraph(filename, N)
+    finally:
+        os.remove(filename)
+
+# Returns the (source ids, destination ids) arrays of all the edges in the graph.
+def getEdgeArrays(graph):
+    numEdges = graph.GetEdges()
+    srcs = np.fromiter((edge.GetSrcNId() for edge in graph.Edges()), dtype=np.int64, count=numEdges)
+    dsts = np.fromiter((edge.GetDstNId() for edge in graph.Edges()), dtype=np.int64, count=numEdges)
+    return srcs, dsts
+
 # Generator over all the recipient nodes in the graph
 # If cfs is True we only return nodes with valid cfs scores (i.e. IsRecip == 1)
 # If cfs is False we also return nodes without valid cfs scores (i.e. IsRecip ==
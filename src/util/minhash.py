@@ -0,0 +1,128 @@
+# Module: minhash
+# MinHash signatures and locality-sensitive hashing (LSH) over sets of node ids,
+# used to find donor pairs with high Jaccard similarity without comparing every
+# pair of donors.
+
+import random
+import numpy as np
+from collections import defaultdict
+
+# Mersenne prime used as the modulus of the universal hash family
+# h(x) = (a * x + b) mod PRIME. Node ids and coefficients are below 2^31, so the
+# products fit in an int64.
+PRIME = (1 << 31) - 1
+
+# Upper bound on the size of the intermediate (items x hashes) array built while
+# computing signatures.
+MAX_CHUNK_ELEMS = 1 << 24
+
+# Given a list of ids, a dict from each id to a non-empty set of ints, the number
+# of hash functions, and a random seed, returns a len(ids) x numHashes int64
+# array whose ith row is the MinHash signature of sets[ids[i]].
+def getSignatures(ids, sets, numHashes=100, seed=0):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, PRIME, size=numHashes).astype(np.int64)
+    b = rng.randint(0, PRIME, size=numHashes).astype(np.int64)
+
+    # Flatten all the sets into one array, remembering where each one starts
+    sizes = np.array([len(sets[i]) for i in ids], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    items = np.fromiter((x for i in ids for x in sets[i]), dtype=np.int64,
+            count=int(sizes.sum()))
+
+    # Hash every item with a chunk of the hash functions at a time, then take
+    # the minimum over each set's segment.
+    signatures = np.empty((len(ids), numHashes), dtype=np.int64)
+    chunk = max(1, MAX_CHUNK_ELEMS // max(1, len(items)))
+    for start in range(0, numHashes, chunk):
+        end = min(numHashes, start + chunk)
+        hashes = (np.outer(items, a[start:end]) + b[start:end]) % PRIME
+        signatures[:, start:end] = np.minimum.reduceat(hashes, offsets, axis=0)
+
+    return signatures
+
+# Given a signature matrix and a number of bands (which must divide the number of
+# hash functions), returns a sorted int64 array of the candidate pairs i < j
+# whose signatures agree on every row of at least one band. Each pair is encoded
+# as i * numRows + j (see decodePairs). Buckets bigger than maxBucketSize are
+# skipped, since they are dominated by hubs and would produce quadratically many
+# candidates.
+def getCandidatePairs(signatures, numBands, maxBucketSize=None):
+    numRows, numHashes = signatures.shape
+    if numHashes % numBands != 0:
+        raise ValueError('%d bands do not divide %d hash functions' % (numBands, numHashes))
+    rowsPerBand = numHashes // numBands
+
+    # Random odd multipliers used to collapse a band into a single bucket key
+    multipliers = np.random.RandomState(numBands).randint(1, PRIME, size=rowsPerBand)
+    multipliers = multipliers.astype(np.int64) * 2 + 1
+
+    pairs = []
+    for band in range(numBands):
+        cols = slice(band * rowsPerBand, (band + 1) * rowsPerBand)
+        keys = signatures[:, cols].dot(multipliers)
+
+        # Group rows with identical keys
+        order = np.argsort(keys, kind='mergesort')
+        sortedKeys = keys[order]
+        bounds = np.flatnonzero(np.diff(sortedKeys)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [numRows]))
+
+        for start, end in zip(starts, ends):
+            size = end - start
+            if size < 2 or (maxBucketSize and size > maxBucketSize):
+                continue
+            members = np.sort(order[start:end])
+            i, j = np.triu_indices(size, 1)
+            pairs.append(members[i] * numRows + members[j])
+
+    if not pairs:
+        return np.zeros(0, dtype=np.int64)
+    return np.unique(np.concatenate(pairs))
+
+# Splits the encoded pairs from getCandidatePairs back into two index arrays.
+def decodePairs(pairs, numRows):
+    return pairs // numRows, pairs % numRows
+
+# Given a signature matrix and two index arrays, returns the estimated Jaccard
+# similarity of each pair (the fraction of hash functions on which they agree).
+def estimateJaccard(signatures, rows1, rows2, chunkSize=100000):
+    estimates = np.empty(len(rows1))
+    for start in range(0, len(rows1), chunkSize):
+        end = start + chunkSize
+        agree = signatures[rows1[start:end]] == signatures[rows2[start:end]]
+        estimates[start:end] = agree.mean(axis=1)
+    return estimates
+
+# Given a list of ids, a dict from each id to a set, the set of approximate
+# pairs (as frozensets of two ids), a Jaccard threshold, a sample size, and a
+# seed, returns the fraction of exact pairs with Jaccard similarity of at least
+# minJaccard that touch a sampled id and were also found approximately, along
+# with the number of such exact pairs.
+def getRecall(ids, sets, approxPairs, minJaccard=0.0, sampleSize=1000, seed=0):
+    sample = random.Random(seed).sample(ids, min(sampleSize, len(ids)))
+
+    # Index from set element to the ids whose sets contain it
+    members = defaultdict(list)
+    for i in ids:
+        for x in sets[i]:
+            members[x].append(i)
+
+    numExact = numFound = 0
+    for id1 in sample:
+        neighbors = set()
+        for x in sets[id1]:
+            neighbors.update(members[x])
+        neighbors.discard(id1)
+
+        for id2 in neighbors:
+            shared = len(sets[id1].intersection(sets[id2]))
+            if float(shared) / len(sets[id1].union(sets[id2])) < minJaccard:
+                continue
+            numExact += 1
+            if frozenset((id1, id2)) in approxPairs:
+                numFound += 1
+
+    recall = float(numFound) / numExact if numExact else 1.0
+    return recall, numExact
@@ -0,0 +1,101 @@
+# Module: pruned_graphs
+# All the percent and threshold pruned unipartite graphs for a (year, weighting)
+# are prefixes of the same weight-sorted edge order, so instead of saving one
+# snap graph per pruning level we save that edge order once, along with the
+# number of edges kept at each of the standard pruning levels:
+#
+#   Data/Unipartite-Edges/<year>.<weighting>.rows.npy     smaller node ids
+#   Data/Unipartite-Edges/<year>.<weighting>.cols.npy     larger node ids
+#   Data/Unipartite-Edges/<year>.<weighting>.weights.npy  decreasing weights
+#   Data/Unipartite-Edges/<year>.<weighting>.cuts         N and the cut offsets
+#
+# Any percent or threshold (not just the saved levels) can then be materialized
+# on demand, either as array views, a sparse adjacency matrix or a snap graph.
+
+import numpy as np
+import scipy.sparse as sp
+import graph_funcs, pickler
+
+EDGES_DIR = 'Data/Unipartite-Edges'
+
+def _prefix(year, weighting):
+    return '%s/%d.%s' % (EDGES_DIR, year, weighting)
+
+# Given weights sorted in decreasing order and a weight threshold, returns how
+# many of the weights at least meet the threshold.
+def getNumEdgesAboveThreshold(weights, threshold):
+    return int(np.searchsorted(-weights, -threshold, side='right'))
+
+# Returns the name of a pruning level, as used in the pruned graph, feature and
+# recipient feature filenames (e.g. '2012.jaccard2_percent_0.010000').
+def getLevelName(year, weighting, kind, value):
+    return '%d.%s_%s_%f' % (year, weighting, kind, value)
+
+class PrunedGraphs:
+    # rows, cols and weights are the edges sorted by decreasing weight, N is the
+    # number of nodes, and cuts is a list of (kind, value) pruning levels, where
+    # kind is 'percent' or 'threshold'.
+    def __init__(self, rows, cols, weights, N, cuts=()):
+        self.rows = rows
+        self.cols = cols
+        self.weights = weights
+        self.N = N
+        self.offsets = {}
+        for kind, value in cuts:
+            self.offsets[(kind, value)] = self.getNumEdges(kind, value)
+
+    # Returns the number of edges kept at a pruning level.
+    def getNumEdges(self, kind, value):
+        if (kind, value) in self.offsets:
+            return self.offsets[(kind, value)]
+        if kind == 'percent':
+            return int(len(self.weights) * value)
+        if kind == 'threshold':
+            return getNumEdgesAboveThreshold(self.weights, value)
+        raise ValueError('Unknown pruning level kind %s' % kind)
+
+    # Returns the saved pruning levels as (kind, value) tuples, from the
+    # sparsest to the densest graph.
+    def getLevels(self):
+        return sorted(self.offsets, key=lambda level: (self.offsets[level], level))
+
+    # Returns views of the (rows, cols, weights) arrays for the edges kept at a
+    # pruning level. No data is copied.
+    def getEdges(self, kind, value):
+        numEdges = self.getNumEdges(kind, value)
+        return self.rows[:numEdges], self.cols[:numEdges], self.weights[:numEdges]
+
+    # Returns the symmetric N x N CSR adjacency matrix of a pruning level, with
+    # the edge weights as values if weighted is True and ones otherwise.
+    def getAdjacency(self, kind, value, weighted=True):
+        rows, cols, weights = self.getEdges(kind, value)
+        data = np.asarray(weights, dtype=np.float64) if weighted else np.ones(len(rows))
+        upper = sp.csr_matrix((data, (rows, cols)), shape=(self.N, self.N))
+        return (upper + upper.T).tocsr()
+
+    # Returns the snap.TUNGraph of a pruning level, with nodes 0..N-1.
+    def getGraph(self, kind, value):
+        rows, cols, weights = self.getEdges(kind, value)
+        return graph_funcs.graphFromEdgeArrays(rows, cols, self.N)
+
+# Saves the sorted edges and cut offsets of a PrunedGraphs for a year and weighting.
+def save(year, weighting, prunedGraphs):
+    prefix = _prefix(year, weighting)
+    np.save(prefix + '.rows.npy', prunedGraphs.rows)
+    np.save(prefix + '.cols.npy', prunedGraphs.cols)
+    np.save(prefix + '.weights.npy', prunedGraphs.weights)
+    pickler.save((prunedGraphs.N, prunedGraphs.offsets), prefix + '.cuts')
+
+# Loads the PrunedGraphs for a year and weighting, with the edge arrays memory
+# mapped so that only the edges of the levels actually used are read.
+def load(year, weighting):
+    prefix = _prefix(year, weighting)
+    N, offsets = pickler.load(prefix + '.cuts')
+    prunedGraphs = PrunedGraphs(
+        np.load(prefix + '.rows.npy', mmap_mode='r'),
+        np.load(prefix + '.cols.npy', mmap_mode='r'),
+        np.load(prefix + '.weights.npy', mmap_mode='r'),
+        N
+    )
+    prunedGraphs.offsets = offsets
+    return prunedGraphs
@@ -0,0 +1,83 @@
+# Module: quantile_sketch
+# A small one-pass streaming quantile sketch (in the style of KLL/MRL compactor
+# sketches) used to summarize the distribution of the weights of a donor-donor
+# weight matrix without sorting all of its edges. The sketch keeps a stack of
+# compactors: items at level i each stand for 2^i of the original values, and
+# whenever a level holds more than k items it is sorted and every other item
+# (from a random offset) is promoted to the next level.
+#
+# The summary of each sketch is saved next to the weight matrices, as
+# Data/Unipartite-Matrix/<year>.<metric>.sketch
+
+import numpy as np
+import pickler, weight_store
+
+class QuantileSketch:
+    def __init__(self, k=1024, seed=0):
+        self.k = k
+        self.count = 0
+        self.levels = [np.zeros(0)]
+        self.rng = np.random.RandomState(seed)
+
+    # Adds an array of values to the sketch.
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self.count += len(values)
+        self.compress()
+
+    # Compacts every level holding more than k items, cascading upwards.
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.k:
+                items = np.sort(items)
+                numPaired = len(items) - len(items) % 2
+                promoted = items[self.rng.randint(2):numPaired:2]
+                self.levels[level] = items[numPaired:]
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.zeros(0))
+                self.levels[level + 1] = np.concatenate((self.levels[level + 1], promoted))
+            level += 1
+
+    # Returns the summary of the sketch: a tuple of its items in increasing order
+    # and the cumulative weight (approximate rank) of each item.
+    def getSummary(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.repeat(2.0 ** i, len(l)) for i, l in enumerate(self.levels)])
+        order = np.argsort(items, kind='mergesort')
+        return items[order], np.cumsum(weights[order])
+
+# Given a sketch summary and a list of quantiles in [0, 1], returns the
+# approximate value at each quantile.
+def getQuantiles(summary, quantiles):
+    items, cumWeights = summary
+    ranks = np.asarray(quantiles, dtype=np.float64) * cumWeights[-1]
+    indices = np.searchsorted(cumWeights, ranks, side='left')
+    return items[np.minimum(indices, len(items) - 1)]
+
+# Given an array (typically a memory-mapped weight column), streams over it in
+# chunks of chunkSize values and returns the summary of its sketch.
+def summarize(values, k=1024, chunkSize=1 << 20):
+    sketch = QuantileSketch(k)
+    for start in range(0, len(values), chunkSize):
+        sketch.update(values[start:start + chunkSize])
+    return sketch.getSummary()
+
+def _path(year, metric):
+    return '%s/%d.%s.sketch' % (weight_store.MATRIX_DIR, year, metric)
+
+# Computes and saves the sketch summary of one weighting's stored weights.
+def saveSummary(year, metric, k=1024):
+    summary = summarize(weight_store.loadWeights(year, metric), k)
+    pickler.save(summary, _path(year, metric))
+    return summary
+
+# Loads the sketch summary of one weighting's stored weights, computing and
+# saving it first if it doesn't exist yet.
+def loadSummary(year, metric):
+    try:
+        return pickler.load(_path(year, metric))
+    except IOError:
+        return saveSummary(year, metric)
@@ -0,0 +1,59 @@
+# Module: recip_features
+# Storage for the recipient feature matrices the regressions are trained on
+# (see recip_feature_extractor.saveFeatures). A feature matrix is saved as one
+# uncompressed archive, <filename>.npz, holding
+#
+#   X          the recipients x features array (float32 or float64)
+#   Y          the cfscore of each row
+#   rnodeids   the rnodeid of each row
+#
+# where filename is e.g. Data/Recip-Features/<level>. Since the archive isn't
+# compressed, its arrays are loaded as read-only memory maps into it.
+
+import struct, zipfile
+import numpy as np
+
+ARRAYS = ('X', 'Y', 'rnodeids')
+
+# Saves the X feature matrix, Y vector and row rnodeids under filename.
+def save(filename, X, Y, rnodeids):
+    np.savez(filename + '.npz', X=X, Y=Y, rnodeids=rnodeids)
+
+# Returns a read-only memory map of the array stored as member name of the
+# uncompressed .npz archive at path, or None if it can't be mapped.
+def _mapMember(path, archive, name):
+    info = archive.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+
+    with open(path, 'rb') as f:
+        # Skip the zip local file header to the start of the .npy data
+        f.seek(info.header_offset)
+        nameLength, extraLength = struct.unpack('<HH', f.read(30)[26:30])
+        f.seek(info.header_offset + 30 + nameLength + extraLength)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortranOrder, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortranOrder, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    if dtype.hasobject or 0 in shape:
+        return None
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+            order='F' if fortranOrder else 'C')
+
+# Loads the X feature matrix, Y vector and row rnodeids saved under filename,
+# memory-mapped unless mmap is False.
+def load(filename, mmap=True):
+    path = filename + '.npz'
+    arrays = np.load(path)
+    if mmap:
+        archive = zipfile.ZipFile(path)
+        mapped = [_mapMember(path, archive, name) for name in ARRAYS]
+        archive.close()
+        loaded = [array if array is not None else arrays[name] for name, array in zip(ARRAYS, mapped)]
+    else:
+        loaded = [arrays[name] for name in ARRAYS]
+    arrays.close()
+    return tuple(loaded)
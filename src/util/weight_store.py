@@ -0,0 +1,64 @@
+# Module: weight_store
+# Storage for the donor-donor weight matrices of a cycle. Every weighting
+# function scores the same donor pairs, so the matrices share one sparsity
+# structure. It is stored once, as the strictly upper-triangular part of the
+# symmetric matrix in CSR form, and each weighting only stores its column of
+# values in the same order:
+#
+#   Data/Unipartite-Matrix/<year>.indptr.npy    CSR row pointers
+#   Data/Unipartite-Matrix/<year>.indices.npy   CSR column indices
+#   Data/Unipartite-Matrix/<year>.<metric>.npy  values for one weighting
+#
+# All the arrays are loaded as read-only memory maps, so a stage that only
+# needs one weighting never reads the others.
+
+import numpy as np
+import scipy.sparse as sp
+
+MATRIX_DIR = 'Data/Unipartite-Matrix'
+
+def _path(year, name):
+    return '%s/%d.%s.npy' % (MATRIX_DIR, year, name)
+
+# Given a year and a dictionary from metric name to symmetric sparse weight
+# matrix (all with the same nonzero entries), saves the shared upper-triangular
+# structure and one value column per metric, cast to dtype.
+def saveMatrices(year, matrices, dtype=np.float64):
+    indptr = indices = None
+
+    for metric, adjMat in matrices.iteritems():
+        upper = sp.triu(adjMat, k=1, format='csr')
+        upper.sort_indices()
+
+        if indices is None:
+            indptr, indices = upper.indptr, upper.indices
+            np.save(_path(year, 'indptr'), indptr)
+            np.save(_path(year, 'indices'), indices)
+        elif not (np.array_equal(upper.indptr, indptr) and np.array_equal(upper.indices, indices)):
+            raise ValueError('Weight matrix for %s does not share the sparsity structure' % metric)
+
+        np.save(_path(year, metric), upper.data.astype(dtype))
+
+# Returns the memory-mapped (indptr, indices) arrays of the upper-triangular
+# structure shared by all the weight matrices of this year.
+def loadStructure(year):
+    indptr = np.load(_path(year, 'indptr'), mmap_mode='r')
+    indices = np.load(_path(year, 'indices'), mmap_mode='r')
+    return indptr, indices
+
+# Returns the memory-mapped value column of one weighting, aligned with the
+# arrays returned by loadStructure.
+def loadWeights(year, metric):
+    return np.load(_path(year, metric), mmap_mode='r')
+
+# Returns the weight matrix of one weighting as a CSR matrix. If symmetric is
+# False only the (memory-mapped) upper triangle is returned; otherwise the full
+# symmetric matrix is built in memory. A previously loaded structure can be
+# passed in to avoid reloading it.
+def loadMatrix(year, metric, symmetric=True, structure=None):
+    indptr, indices = structure if structure is not None else loadStructure(year)
+    N = len(indptr) - 1
+    upper = sp.csr_matrix((loadWeights(year, metric), indices, indptr), shape=(N, N))
+    if not symmetric:
+        return upper
+    return (upper + upper.T).tocsr()
@@ -5,31 +5,28 @@
 
 import sys
 import numpy as np
-from util import pickler
+from util import weight_store
 from util.Timer import Timer
 
 ################################################################################
 # Module functions #
 ################################################################################
 
-# Loads the adjacency matrix for a particular year-weight function pairing and
-# returns a vector of all the nonzero entries for that matrix.
-# Return format is 1 x N numpy array (NOT vector)
+# Loads the weights for a particular year-weight function pairing and returns a
+# vector of all the nonzero (upper-triangular) entries for that matrix.
 def getNonzeroElems(year, weightF):
     timing = Timer('Loading nonzero elems for year %d and weightf %s ' % (year, weightF))
-    adjMat = pickler.load('Data/Unipartite-Matrix/%d.%s' % (year, weightF))
+    weights = weight_store.loadWeights(year, weightF)
     timing.finish()
-    return adjMat[adjMat.nonzero()]
+    return weights
 
-# Actually generates the correlatiion matrix. We can afford to simpy call the
-# nonzero function of each adjacency matrix individually (as opposed to caching
-# a single common set of indices) since we know that all the adjacency matrices
-# have the same set of nonzero indices (namely, the donors that had at least
-# one candidate in common).
+# Actually generates the correlatiion matrix. Since all the weight matrices are
+# stored with the same sparsity structure (namely, the donors that had at least
+# one candidate in common), their value columns are already aligned and can be
+# stacked directly.
 def getCorrel(year, weightFs):
     timing = Timer('Getting correlation matrix for year %d' % year)
-    append = lambda x, y: np.append(x, y, axis=0)
-    data = reduce(append, [getNonzeroElems(year, weightF) for weightF in weightFs])
+    data = np.vstack([getNonzeroElems(year, weightF) for weightF in weightFs])
     timing.finish()
     return np.corrcoef(data)
 
@@ -38,7 +35,7 @@ def getCorrel(year, weightFs):
 ################################################################################
 
 if __name__ == '__main__':
-    weightFs = (, 'cosine', 'jaccard', 'jaccard2', 'adamic', 'weighted_adamic')
+    weightFs = ('cosine', 'jaccard', 'jaccard2', 'adamic', 'weighted_adamic')
     for arg in sys.argv[1:]:
         year = int(arg)
         cov = getCorrel(year, weightFs)